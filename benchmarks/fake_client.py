@@ -0,0 +1,223 @@
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from telethon.errors import FloodWaitError
+from telethon.tl.types import Channel, ChatPhotoEmpty, MessageMediaPhoto, MessageMediaDocument, MessageMediaGeo
+
+
+class SyntheticChannel:
+    """Synthetic channel for benchmarks: messages, senders, comments and admin log.\n
+    Everything is generated from seed, so the same parameters always give the same channel.
+    :param messages: number of messages
+    :param media_ratio: part of messages with photo/document
+    :param reply_ratio: part of messages with comments
+    :param senders: number of distinct senders
+    :param participants: number of channel participants
+    :param admin_log: number of admin log events
+    :param media_size: size of downloaded media files in bytes
+    """
+    def __init__(self, username: str = "bench_channel", messages: int = 1000, media_ratio: float = 0.3,
+                 reply_ratio: float = 0.05, comments_per_post: int = 10, senders: int = 100,
+                 participants: int = 500, admin_log: int = 100, media_size: int = 4096, seed: int = 0):
+        self.username = username
+        self.rng = random.Random(seed)
+        self.media_size = media_size
+        self.comments_per_post = comments_per_post
+        self.entity = Channel(id=1000, title="Benchmark channel", photo=ChatPhotoEmpty(),
+                              date=datetime(2020, 1, 1, tzinfo=timezone.utc), megagroup=False, broadcast=True,
+                              username=username)
+        self.users = [self._user(user_id) for user_id in range(1, max(senders, participants) + 1)]
+        self.senders = self.users[:senders]
+        self.participants = self.users[:participants]
+        self.messages = [self._message(message_id, media_ratio, reply_ratio) for message_id in range(1, messages + 1)]
+        self.admin_log = [self._admin_event(event_id) for event_id in range(1, admin_log + 1)]
+
+    def _user(self, user_id: int):
+        return SimpleNamespace(id=user_id, first_name=f"User{user_id}", last_name=None, username=f"user{user_id}",
+                               bot=False, photo=SimpleNamespace(photo_id=10 ** 6 + user_id) if user_id % 2 else None)
+
+    def _admin_event(self, event_id: int):
+        """Admin log event, like telethon's AdminLogEvent it carries the user who performed it"""
+        user = self.rng.choice(self.senders)
+        return SimpleNamespace(id=event_id, user_id=user.id, user=user, date=self._date(event_id),
+                               action=SimpleNamespace(prev_value=f"Title {event_id - 1}", new_value=f"Title {event_id}"))
+
+    @staticmethod
+    def _date(message_id: int):
+        return datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=message_id)
+
+    def _message(self, message_id: int, media_ratio: float, reply_ratio: float):
+        media = None
+        roll = self.rng.random()
+        if roll < media_ratio / 2:
+            media = MessageMediaPhoto(photo=SimpleNamespace(id=message_id))
+        elif roll < media_ratio:
+            media = MessageMediaDocument(document=SimpleNamespace(id=message_id, mime_type="video/mp4",
+                                                                  size=self.media_size))
+        elif roll < media_ratio + 0.01:
+            media = MessageMediaGeo(geo=SimpleNamespace(lat=50.45, long=30.52))
+        replies = self.comments_per_post if self.rng.random() < reply_ratio else 0
+        sender = self.rng.choice(self.senders)
+        return FakeMessage(message_id, f"Message {message_id}", self._date(message_id), sender, media,
+                           SimpleNamespace(replies=replies), self.media_size)
+
+    def comments(self, post_id: int):
+        return [FakeMessage(10 ** 7 + post_id * 1000 + n, f"Comment {n}", self._date(post_id), self.senders[n % len(self.senders)],
+                            None, None, 0) for n in range(1, self.comments_per_post + 1)]
+
+
+class FakeMessage:
+    """Message with the attributes Scraper reads and async download_media(),
+    like telethon's messages it carries its sender from the same response"""
+    client = None
+
+    def __init__(self, message_id, text, date, sender, media, replies, media_size):
+        self.id = message_id
+        self.text = self.message = text
+        self.date = date
+        self.edit_date = None
+        self.sender = sender
+        self.from_id = SimpleNamespace(user_id=sender.id) if sender else None
+        self.media = media
+        self.replies = replies
+        self._media_size = media_size
+
+    async def download_media(self, file=None):
+        return await self.client.download_media(self, file=file)
+
+
+class FakeClient:
+    """Local stand-in for TelegramClient, serves SyntheticChannel with injected latency and FloodWaits.\n
+    Counts calls of each method in `calls`.
+    :param channel: SyntheticChannel
+    :param latency: seconds added to each request (and each page of iterators)
+    :param flood_ratio: probability that a request raises FloodWaitError
+    :param flood_seconds: seconds of injected FloodWaitError
+    :param bandwidth: bytes per second of media downloads, None for instant downloads
+    :param aliases: other usernames resolved to the same channel (to scrape it as several targets)
+    """
+    def __init__(self, channel: SyntheticChannel, latency: float = 0.0, flood_ratio: float = 0.0,
+                 flood_seconds: int = 1, bandwidth: float = None, seed: int = 0, aliases: tuple = ()):
+        self.channel = channel
+        self.usernames = {username.lower() for username in (channel.username, *aliases)}
+        self.latency = latency
+        self.flood_ratio = flood_ratio
+        self.flood_seconds = flood_seconds
+        self.bandwidth = bandwidth
+        self.rng = random.Random(seed)
+        self.calls = {}
+        self._connected = False
+        self._users = {user.id: user for user in channel.users}
+        FakeMessage.client = self
+
+    async def _request(self, name: str, pages: int = 1):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency * pages)
+        if self.flood_ratio and self.rng.random() < self.flood_ratio:
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+    async def _pages(self, name: str, items, page_size: int = 100):
+        """Yield items, one request (with latency and FloodWait) per page"""
+        for index, item in enumerate(items):
+            if index % page_size == 0:
+                await self._request(name)
+            yield item
+
+    def is_connected(self):
+        return self._connected
+
+    async def start(self):
+        self._connected = True
+        return self
+
+    async def disconnect(self):
+        self._connected = False
+
+    async def get_me(self):
+        await self._request("get_me")
+        return SimpleNamespace(id=0)
+
+    async def get_entity(self, key):
+        await self._request("get_entity")
+        if isinstance(key, str) and key.lstrip("@").lower() in self.usernames:
+            return self.channel.entity
+        user_id = getattr(key, "id", key)
+        if user_id in self._users:
+            return self._users[user_id]
+        raise ValueError(f"Could not find the input entity for {key!r}")
+
+    async def get_permissions(self, entity, user=None):
+        await self._request("get_permissions")
+        return SimpleNamespace(is_admin=True, is_creator=False)
+
+    def iter_messages(self, entity, limit=None, offset_id=0, min_id=0, max_id=0, reply_to=None, **kwargs):
+        if reply_to is not None:
+            items = list(reversed(self.channel.comments(reply_to)))
+        else:
+            items = list(reversed(self.channel.messages))
+        items = [m for m in items
+                 if (not offset_id or m.id < offset_id) and m.id > (min_id or 0) and (not max_id or m.id < max_id)]
+        return self._pages("iter_messages", items if limit is None else items[:limit])
+
+    async def get_messages(self, entity, limit=None, ids=None, **kwargs):
+        await self._request("get_messages")
+        if ids is not None:
+            by_id = {m.id: m for m in self.channel.messages}
+            return [by_id.get(message_id) for message_id in ids]
+        if kwargs.get("filter") is not None:  # pinned messages
+            return [m for m in reversed(self.channel.messages) if m.id % 500 == 0][:limit]
+        return list(reversed(self.channel.messages))[:limit]
+
+    async def get_participants(self, entity, **kwargs):
+        await self._request("get_participants", pages=max(1, len(self.channel.participants) // 200))
+        return list(self.channel.participants)
+
+    def iter_participants(self, entity, limit=None, search="", **kwargs):
+        users = [u for u in self.channel.participants
+                 if not search or search.lower() in (u.first_name or "").lower() or search.lower() in (u.username or "")]
+        return self._pages("iter_participants", users[:limit] if limit else users, page_size=200)
+
+    def iter_admin_log(self, entity, min_id=0, max_id=0, **kwargs):
+        events = [e for e in reversed(self.channel.admin_log) if e.id > (min_id or 0) and (not max_id or e.id < max_id)]
+        return self._pages("iter_admin_log", events)
+
+    async def get_profile_photos(self, entity, **kwargs):
+        await self._request("get_profile_photos")
+        return []
+
+    async def download_media(self, message, file=None, **kwargs):
+        await self._request("download_media")
+        size = getattr(message, "_media_size", 0)
+        if self.bandwidth:
+            await asyncio.sleep(size / self.bandwidth)
+        with open(file, "wb") as f:
+            f.write(b"\0" * size)
+        return file
+
+    async def iter_download(self, file, offset=0, limit=None, request_size=512 * 1024, file_size=None, **kwargs):
+        """Chunks of zero bytes of document, one request per chunk"""
+        await self._request("iter_download")
+        size = file_size or getattr(file, "size", 0)
+        end = size if limit is None else min(size, offset + limit * request_size)
+        for start in range(offset, end, request_size):
+            self.calls["get_file"] = self.calls.get("get_file", 0) + 1
+            chunk = min(request_size, end - start)
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.bandwidth:
+                await asyncio.sleep(chunk / self.bandwidth)
+            yield b"\0" * chunk
+
+    async def download_profile_photo(self, entity, file=None, **kwargs):
+        await self._request("download_profile_photo")
+        with open(file, "wb") as f:
+            f.write(b"\0" * 512)
+        return file
+
+    async def __call__(self, request):
+        await self._request(type(request).__name__)
+        return SimpleNamespace(full_chat=SimpleNamespace(about="Synthetic channel", participants_count=len(self.channel.participants),
+                                                         admins_count=1, kicked_count=0, banned_count=0, online_count=0,
+                                                         chat_photo=None))
@@ -0,0 +1,178 @@
+"""Offline benchmark of Scraper on a synthetic channel served by FakeClient.
+
+Scraper is measured without rate limiter delays (they would hide its own cost) unless --rate-limit is given,
+results with the limiter are compared with their own baseline. Every scenario runs in its own process,
+so peak RSS is measured per scenario.
+
+Usage:
+    python -m benchmarks.run                         # compare with benchmarks/baseline.json (default parameters)
+    python -m benchmarks.run --messages 5000 --latency 0.01
+    python -m benchmarks.run --save-baseline        # store results as benchmarks/baseline.json
+    python -m benchmarks.run --rate-limit            # with Config.rpc_rates, compared with baseline_rate_limit.json
+    python -m benchmarks.run --tolerance 0.2         # fail if messages/sec drops by more than 20%
+    python -m benchmarks.run --scenario pool --sessions 4 --targets 8
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("API_ID", "0")
+os.environ.setdefault("API_HASH", "benchmark")
+
+from bot import Config, Scraper
+from bot.metrics import metrics
+from bot.pool import ClientPool, Session
+from bot.scheduler import Scheduler, scrape_target
+from benchmarks.fake_client import FakeClient, SyntheticChannel
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+RATE_LIMIT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_rate_limit.json")
+SCENARIOS = ("fetch_messages", "get_members", "full")  # run by --scenario all
+EXTRA_SCENARIOS = ("pool",)  # run only when chosen explicitly
+
+
+def scenario_process(name: str, args) -> dict:
+    """Run one scenario in a fresh process and working directory, so scenarios don't share
+    output, checkpoint, media store, caches or peak RSS"""
+    if not args.rate_limit:
+        Config.rpc_rates = {rpc_class: (10 ** 6, 10 ** 6) for rpc_class in Config.rpc_rates}
+    workdir = tempfile.mkdtemp(prefix=f"scraper_bench_{name}_")
+    os.chdir(workdir)
+    Config.metrics_folder = os.path.join(workdir, "metrics")
+    return asyncio.run(run_scenario(name, args))
+
+
+async def run_scenario(name: str, args) -> dict:
+    channel = SyntheticChannel(messages=args.messages, media_ratio=args.media_ratio, reply_ratio=args.reply_ratio,
+                               comments_per_post=args.comments_per_post, senders=args.senders,
+                               participants=args.participants, media_size=args.media_size)
+    targets = [(f"{channel.username}_{n}", 0) for n in range(args.targets)]
+    clients = [FakeClient(channel, latency=args.latency, flood_ratio=args.flood_ratio, flood_seconds=args.flood_seconds,
+                          bandwidth=args.bandwidth, aliases=[target for target, _ in targets])
+               for _ in range(args.sessions if name == "pool" else 1)]
+    client = clients[0]
+    Config.client = client
+
+    if name == "pool":
+        # Several targets (all served by the same synthetic channel) spread across fake sessions
+        pool = ClientPool([Session(f"session{n}", fake) for n, fake in enumerate(clients)])
+        scheduler = Scheduler(targets, concurrency=args.targets, limit=None, only_new=False, stages=["messages"],
+                              pool=pool)
+        start = time.perf_counter()
+        await scheduler.run()
+        wall = time.perf_counter() - start
+        records = metrics.snapshot()["counters"].get("messages", 0)
+        calls = {}
+        for fake in clients:
+            for rpc, count in fake.calls.items():
+                calls[rpc] = calls.get(rpc, 0) + count
+        return {
+            "wall_seconds": round(wall, 3),
+            "records": records,
+            "records_per_second": round(records / wall, 1) if wall else 0,
+            "rpc_calls": dict(sorted(calls.items())),
+            "rpc_total": sum(calls.values()),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+    bot = Scraper(channel.username)
+    start = time.perf_counter()
+    await bot.initialize()
+    if name == "fetch_messages":
+        await bot.fetch_messages(limit=None, collect=False)
+    elif name == "get_members":
+        await bot.get_members()
+    else:
+        await scrape_target(bot, limit=None)
+    await bot.close_sinks()
+    wall = time.perf_counter() - start
+
+    counters = metrics.snapshot()["counters"]
+    records = counters.get("participants", 0) if name == "get_members" else counters.get("messages", 0)
+    return {
+        "wall_seconds": round(wall, 3),
+        "records": records,
+        "records_per_second": round(records / wall, 1) if wall else 0,
+        "rpc_calls": dict(sorted(client.calls.items())),
+        "rpc_total": sum(client.calls.values()),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Compare results with baseline, returns list of regressions"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["records_per_second"] < base["records_per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['records_per_second']} records/sec, baseline {base['records_per_second']}")
+        if result["rpc_total"] > base["rpc_total"] * (1 + tolerance):
+            regressions.append(f"{name}: {result['rpc_total']} RPCs, baseline {base['rpc_total']}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline Scraper benchmark with fake telegram client")
+    parser.add_argument("--scenario", choices=SCENARIOS + EXTRA_SCENARIOS + ("all",), default="all")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--media-ratio", type=float, default=0.3)
+    parser.add_argument("--reply-ratio", type=float, default=0.05)
+    parser.add_argument("--comments-per-post", type=int, default=10)
+    parser.add_argument("--senders", type=int, default=200)
+    parser.add_argument("--participants", type=int, default=1000)
+    parser.add_argument("--media-size", type=int, default=4096, help="bytes")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per request")
+    parser.add_argument("--bandwidth", type=float, default=None, help="media download bytes per second")
+    parser.add_argument("--flood-ratio", type=float, default=0.0, help="probability of FloodWait per request")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--sessions", type=int, default=2, help="fake sessions of pool scenario")
+    parser.add_argument("--targets", type=int, default=4, help="targets of pool scenario")
+    parser.add_argument("--rate-limit", action="store_true", help="measure with rate limiter delays (Config.rpc_rates)")
+    parser.add_argument("--baseline", default=None, help="baseline file (depends on --rate-limit by default)")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against baseline")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    args.baseline = os.path.abspath(args.baseline or (RATE_LIMIT_BASELINE_PATH if args.rate_limit else BASELINE_PATH))
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        sys.exit(f"Baseline {args.baseline} doesn't exist, create it with --save-baseline")
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for name in (SCENARIOS if args.scenario == "all" else (args.scenario,)):
+        with context.Pool(1) as pool:
+            results[name] = pool.apply(scenario_process, (name, args))
+        print(f"{name}: {json.dumps(results[name])}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    for name in results:
+        if name not in baseline:
+            print(f"[WARNING] {name} isn't in baseline, not compared")
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"[REGRESSION] {regression}")
+    if regressions:
+        sys.exit(1)
+    print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
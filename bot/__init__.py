@@ -1,4 +1,20 @@
-from .start import start_bot
-from .scraper import Scraper
-from .utils import dump_json
-from .settings import Config
+import importlib
+
+# Submodules are imported on first access (PEP 562), so "import bot" doesn't pull in telethon
+_EXPORTS = {
+    "start_bot": ".start",
+    "Scraper": ".scraper",
+    "dump_json": ".utils",
+    "Config": ".settings",
+}
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = list(_EXPORTS)
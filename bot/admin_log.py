@@ -0,0 +1,124 @@
+import re
+from datetime import datetime
+from bot.settings import Config, logging, ADMIN_LOG_EVENTS
+from .ratelimit import limited
+from .metrics import metrics
+from .records import AdminLogEntry, UserRef
+
+_ACTION_PREFIX = "ChannelAdminLogEventAction"
+
+
+def action_name(action) -> str:
+    """Short snake_case name of admin log action, e.g. ChannelAdminLogEventActionDeleteMessage -> delete_message"""
+    name = type(action).__name__
+    if name.startswith(_ACTION_PREFIX):
+        name = name[len(_ACTION_PREFIX):]
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower()
+
+
+def _plain(value, depth: int = 0):
+    """Queryable value of action field: scalars as is, messages and participants as small dicts,
+    rights as list of granted ones, anything else as its type name"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return None
+    if isinstance(value, list):
+        return [_plain(item, depth + 1) for item in value]
+    name = type(value).__name__
+    if name.endswith("Rights"):
+        return sorted(key for key, flag in vars(value).items() if flag is True)
+    if hasattr(value, "message") and hasattr(value, "id"):
+        from_id = getattr(value, "from_id", None)
+        return {"id": value.id, "text": value.message, "sender_id": getattr(from_id, "user_id", None)}
+    if depth < 2 and hasattr(value, "__dict__"):
+        return {key: _plain(field, depth + 1) for key, field in vars(value).items()
+                if not key.startswith("_") and not isinstance(field, bytes)}
+    return name
+
+
+def action_details(action) -> dict:
+    """Structured fields of admin log action (previous/new values, affected message or participant)"""
+    return {key: _plain(value) for key, value in vars(action).items() if not key.startswith("_")}
+
+
+class AdminLogExporter:
+    """Incremental export of admin log.\n
+    Only events newer than checkpoint.admin_log_id are fetched (min_id), optionally limited to
+    event types given in Config.admin_log_events (filtered on server side, see ADMIN_LOG_EVENTS).
+    Users involved in events come with the same response, so performers are taken from event.user
+    (or entity cache) instead of being resolved one by one. Each action is written with its short
+    name and structured fields to "admin_logs" output stream and DB sinks.\n
+    Filtered runs don't move checkpoint, so skipped event types are fetched by the next full run.
+    Without JSONL output (Config.stream_output) there's no file which keeps events of earlier runs,
+    so the whole log is fetched every time.\n
+    **Usage:**
+        logs = await AdminLogExporter(bot, events=["ban", "delete"]).run()
+        async for entry in AdminLogExporter(bot).stream(): ...
+    """
+    def __init__(self, scraper, events: list[str] = None):
+        self.scraper = scraper
+        self.events = list(events if events is not None else Config.admin_log_events or [])
+        unknown = set(self.events) - set(ADMIN_LOG_EVENTS)
+        if unknown:
+            raise ValueError(f"Unknown admin log events: {', '.join(sorted(unknown))}")
+        self.logs = []
+
+    async def run(self) -> list[AdminLogEntry]:
+        async for log_entry in self.stream():
+            self.logs.append(log_entry)
+        return self.logs
+
+    async def stream(self):
+        """Yield admin log entries newest first, the next page is requested only when the consumer asks for it"""
+        checkpoint = self.scraper.checkpoint
+        count, newest_id = 0, None
+        incremental = self.scraper.output is not None
+        min_id = (checkpoint.admin_log_id or 0) if incremental else 0
+        kwargs = {event: True for event in self.events}
+        logging.info(f"Fetching admin log events newer than {min_id}" + (f" ({', '.join(self.events)})" if self.events else ""))
+
+        def events_from(last=None):
+            return self.scraper.client.iter_admin_log(self.scraper.target, min_id=min_id,
+                                                      max_id=last.id if last else 0, **kwargs)
+
+        async for event in limited(events_from(), "get_messages", resume=events_from):
+            if Config.stop_event.is_set():
+                logging.info("Interrupted by user")
+                return
+            log_entry = self._to_record(event)
+            count += 1
+            newest_id = max(newest_id or 0, event.id)
+            metrics.inc("admin_logs")
+            await self.scraper._emit("admin_logs", log_entry)
+            yield log_entry
+        # Events come newest first, so checkpoint moves only when all of them were fetched
+        if incremental and not self.events:
+            checkpoint.update_admin_log(newest_id)
+        logging.info(f"Fetched {count} admin log events")
+
+    def _to_record(self, event) -> AdminLogEntry:
+        performed_by = UserRef(user_id=event.user_id)
+        user = getattr(event, "user", None)
+        if user is not None:
+            self.scraper.entities.put(user)
+        else:
+            user = self.scraper.entities.get(event.user_id)
+        error = None
+        if user is not None:
+            performed_by.first_name = getattr(user, "first_name", None)
+            performed_by.last_name = getattr(user, "last_name", None)
+            performed_by.username = getattr(user, "username", None)
+        else:
+            performed_by.first_name = "Unknown"
+            error = f"User {event.user_id} isn't included in admin log response"
+        return AdminLogEntry(
+            id=event.id,
+            action=action_name(event.action),
+            details=action_details(event.action),
+            performed_by=performed_by,
+            timestamp=event.date.isoformat(),
+            error=error,
+        )
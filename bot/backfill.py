@@ -0,0 +1,162 @@
+import asyncio
+import math
+import os
+import time
+from bot.settings import Config, logging
+from .ratelimit import limited
+from .utils import safe_call
+from .metrics import metrics
+from .logs import Progress
+
+
+class Backfill:
+    """Sharded backfill of message history.\n
+    Ids from 1 to the latest message which are not in checkpoint's scraped range yet are split into
+    `shards` ranges, each range is walked by its own iter_messages() cursor (min_id/offset_id), all of them
+    concurrently under the shared rate limiter. Output is merged by finalize() (messages.json is sorted by id).
+    Progress of each shard is kept in checkpoint.shards and saved every Config.backfill_save_interval seconds
+    and when backfill stops (finished, interrupted or failed), so the next run (even after crash) resumes only
+    unfinished ranges. Shard cursor never passes a message which isn't written to output yet (waits for media). Finished parts of shards are merged into
+    checkpoint's scraped range as soon as they connect to it.\n
+    **Usage:**
+        res = await Backfill(bot, shards=8).run()
+    """
+    def __init__(self, scraper, shards: int = None, collect: bool = True):
+        self.scraper = scraper
+        self.shard_count = shards or Config.backfill_shards
+        self.collect = collect
+        self.messages = []
+        self.downloader = None
+        self.comment_fetcher = None
+        self.progress = None
+        self._saved_at = time.monotonic()
+
+    async def latest_id(self) -> int | None:
+        """Id of the newest message of the target (one request)"""
+        messages = await safe_call(lambda: self.scraper.client.get_messages(self.scraper.target, limit=1),
+                                   "backfill", rpc_class="get_messages")
+        return messages[0].id if messages else None
+
+    def plan(self, latest_id: int) -> list[dict]:
+        """Split ids 1..latest_id not scraped yet into shards, newest first"""
+        checkpoint = self.scraper.checkpoint
+        if checkpoint.min_id is None or checkpoint.max_id is None:
+            gaps = [(1, latest_id)]
+        else:
+            gaps = [(checkpoint.max_id + 1, latest_id), (1, checkpoint.min_id - 1)]
+        gaps = [(low, high) for low, high in gaps if low <= high]
+        total = sum(high - low + 1 for low, high in gaps)
+        if not total:
+            return []
+
+        size = max(Config.backfill_min_shard_size, math.ceil(total / self.shard_count))
+        shards = []
+        for low, high in gaps:
+            for shard_high in range(high, low - 1, -size):
+                shards.append({"low": max(low, shard_high - size + 1), "high": shard_high, "next": shard_high + 1})
+        return shards
+
+    async def run(self) -> dict:
+        """Run (or resume) backfill.
+        :returns: dict with target info and messages (empty list if collect is turned off)
+        """
+        checkpoint = self.scraper.checkpoint
+        target_info = await self.scraper.fetch_target_info()
+
+        if checkpoint.shards:
+            logging.info(f"Resuming {len(checkpoint.shards)} unfinished backfill shards")
+        else:
+            latest_id = await self.latest_id()
+            checkpoint.shards = self.plan(latest_id) if latest_id else []
+            logging.info(f"Backfill of ids up to {latest_id} split into {len(checkpoint.shards)} shards")
+
+        self.downloader, self.comment_fetcher = await self.scraper._start_stages()
+        self.progress = Progress("backfill", "messages")
+        try:
+            results = await asyncio.gather(*(self._run_shard(shard) for shard in list(checkpoint.shards)),
+                                           return_exceptions=True)
+            for shard, result in zip(list(checkpoint.shards), results):
+                if isinstance(result, Exception):
+                    logging.warning(f"[Backfill] Shard {shard['low']}..{shard['high']} failed, "
+                                    f"will be resumed by the next run: {result}")
+        finally:
+            await self.scraper._close_stages(self.downloader, self.comment_fetcher)
+            self.progress.finish()
+            self._merge_shards()
+            if os.path.isdir(self.scraper.jsons_folder):
+                checkpoint.save()
+            logging.info(f"Backfill stopped, scraped range: {checkpoint.min_id}..{checkpoint.max_id}, "
+                         f"{len(checkpoint.shards)} shards left")
+
+        self.scraper.save_entity_cache()
+        self.messages.sort(key=lambda msg: msg.id, reverse=True)
+        return {"target": target_info, "messages": self.messages}
+
+    async def _run_shard(self, shard: dict):
+        """Walk shard from its cursor down to its lowest id, shard["next"] follows the last message written
+        to output (messages below the newest one waiting for its media are fetched again by the next run)"""
+        walked, pending = shard["next"], set()
+
+        def advance():
+            shard["next"] = max(pending) + 1 if pending else walked
+
+        def written(msg_data):
+            pending.discard(msg_data.id)
+            advance()
+
+        def messages_from(last=None):
+            return self.scraper.client.iter_messages(self.scraper.target, offset_id=last.id if last else shard["next"],
+                                                     min_id=shard["low"] - 1)
+
+        async for message in limited(messages_from(), "get_messages", resume=messages_from):
+            if Config.stop_event.is_set():
+                logging.info("Interrupted by user")
+                return
+            pending.add(message.id)
+            msg_data = await self.scraper._process_message(message, self.downloader, self.comment_fetcher,
+                                                           on_ready=written)
+            metrics.inc("messages")
+            self.progress.update()
+            walked = message.id
+            advance()
+            if self.collect:
+                self.messages.append(msg_data)
+            if time.monotonic() - self._saved_at >= Config.backfill_save_interval:
+                await self._save_progress()
+        walked = shard["low"]
+        advance()
+        logging.info(f"[Backfill] Shard {shard['low']}..{shard['high']} finished")
+
+    async def _save_progress(self):
+        """Save checkpoint with shard cursors as they were before sinks were flushed, so it never claims
+        records which could still be lost in a crash"""
+        self._saved_at = time.monotonic()
+        checkpoint = self.scraper.checkpoint
+        shards = list(checkpoint.shards)
+        flushed = [shard["next"] for shard in shards]
+        await self.scraper.flush_sinks()
+        if not os.path.isdir(self.scraper.jsons_folder):
+            return
+        live = [shard["next"] for shard in shards]
+        for shard, cursor in zip(shards, flushed):
+            shard["next"] = cursor
+        self._merge_shards()
+        checkpoint.save()
+        for shard, cursor in zip(shards, live):
+            shard["next"] = cursor
+        logging.debug("[Backfill] Checkpoint saved, scraped range: %s..%s, %d shards left",
+                      checkpoint.min_id, checkpoint.max_id, len(checkpoint.shards))
+
+    def _merge_shards(self):
+        """Merge scraped parts of shards which connect to checkpoint's scraped range, drop finished shards"""
+        checkpoint = self.scraper.checkpoint
+        merged = True
+        while merged:
+            merged = False
+            for shard in list(checkpoint.shards):
+                if shard["next"] <= shard["high"] and checkpoint.connects(shard["next"], shard["high"]):
+                    checkpoint.merge_range(shard["next"], shard["high"])
+                    shard["high"] = shard["next"] - 1
+                    merged = True
+                if shard["high"] < shard["low"]:
+                    checkpoint.shards.remove(shard)
@@ -0,0 +1,126 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from bot.settings import Config, logging
+from .utils import safe_call
+from .metrics import metrics
+
+
+class CachedEntity(SimpleNamespace):
+    """Lightweight user entity restored from disk cache.\n
+    Holds only fields used by scraper, so it can't be passed to telethon methods directly,
+    use entity id instead.
+    """
+
+
+class EntityCache:
+    """LRU cache for resolved entities (users, channels) with TTL eviction.\n
+    Shared by all Scraper methods, so each sender is resolved only once per run.
+    Can be saved to disk and loaded back, so the next run of the same target starts warm.\n
+    **Usage:**
+        cache = EntityCache(client)
+        cache.prime(await client.get_participants("durov"))
+        user = await cache.get_entity(user_id)
+    """
+    FIELDS = ("id", "first_name", "last_name", "username", "bot")
+
+    def __init__(self, client, max_size: int = None, ttl: int = None):
+        self.client = client
+        self.max_size = max_size or Config.entity_cache_size
+        self.ttl = ttl or Config.entity_cache_ttl
+        self._entries = OrderedDict()  # key -> (expires_at, entity)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(key):
+        if isinstance(key, str):
+            return key.lower().lstrip("@")
+        return key
+
+    def get(self, key):
+        """Get entity from cache, returns None if entity isn't cached or expired"""
+        key = self._key(key)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, entity = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entity
+
+    def put(self, entity, key=None, expires_at: float = None):
+        """Put entity into cache, under its id and (if given) additional key"""
+        if entity is None:
+            return
+        expires_at = expires_at or time.time() + self.ttl
+        keys = [entity.id] if key is None else [entity.id, self._key(key)]
+        for k in keys:
+            self._entries[k] = (expires_at, entity)
+            self._entries.move_to_end(k)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def prime(self, entities):
+        """Put entities which telethon already returned (e.g. get_participants results) into cache"""
+        for entity in entities or []:
+            if hasattr(entity, "id"):
+                self.put(entity)
+
+    async def get_entity(self, key, method_name: str = "get_entity"):
+        """Resolve entity with cache, calls client.get_entity() only on cache miss.
+        :param key: user id, username or any other value accepted by client.get_entity()
+        :param method_name: method name (optional), used to make debugging easier.
+        """
+        entity = self.get(key)
+        if entity is not None:
+            self.hits += 1
+            metrics.inc("entity_cache_hits")
+            return entity
+        self.misses += 1
+        metrics.inc("entity_cache_misses")
+        async with metrics.timer("entity_resolution"):
+            entity = await safe_call(lambda: self.client.get_entity(key), method_name, rpc_class="get_entity")
+        self.put(entity, key=key if isinstance(key, str) else None)
+        return entity
+
+    def save(self, path: str):
+        """Save cached users to JSON file, other entities are not persisted"""
+        users = {}
+        for expires_at, entity in self._entries.values():
+            if hasattr(entity, "first_name") and entity.id not in users:
+                data = {field: getattr(entity, field, None) for field in self.FIELDS}
+                photo = getattr(entity, "photo", None)
+                data["photo"] = bool(photo)
+                data["photo_id"] = getattr(entity, "photo_id", None) or getattr(photo, "photo_id", None)
+                data["expires_at"] = expires_at
+                users[entity.id] = data
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(list(users.values()), f, ensure_ascii=False)
+        logging.info(f"Saved {len(users)} entities to {path}")
+
+    def load(self, path: str):
+        """Load users saved by save(), expired entries are skipped"""
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                users = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Couldn't load entity cache from {path}: {e}")
+            return
+        now = time.time()
+        loaded = 0
+        for data in users:
+            expires_at = data.pop("expires_at", 0)
+            if expires_at > now:
+                self.put(CachedEntity(**data), expires_at=expires_at)
+                loaded += 1
+        logging.info(f"Loaded {loaded} entities from {path}")
@@ -0,0 +1,88 @@
+import json
+import os
+from datetime import datetime
+from bot.settings import Config, logging
+
+
+class Checkpoint:
+    """Small per-target sidecar file (jsons/checkpoint.json) with scraping progress.\n
+    Keeps the highest and lowest scraped message ids, so the next run can fetch only newer messages
+    (min_id=max_id) or continue with older ones (offset_id=min_id) without reading messages.json,
+    and the last fetched comment of each post, so only new replies are fetched.
+    Scraped id range is always contiguous, runs that don't connect to it are not merged.
+    Unfinished shards of sharded backfill are kept in `shards`, so it can be resumed.\n
+    **Usage:**
+        checkpoint = Checkpoint.load("durov/jsons/checkpoint.json")
+        await bot.fetch_messages(min_id=checkpoint.max_id)
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.max_id = None
+        self.min_id = None
+        self.admin_log_id = None
+        self.comments = {}  # post id -> id of the last fetched comment, Config.checkpoint_comment_posts newest posts
+        self.shards = []  # unfinished backfill shards: {"low", "high", "next"}, [next, high] is already scraped
+        self.updated_at = None
+
+    @classmethod
+    def load(cls, path: str) -> "Checkpoint":
+        checkpoint = cls(path)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return checkpoint
+        except (OSError, ValueError) as e:
+            logging.warning(f"[Checkpoint] Couldn't read {path}: {e}")
+            return checkpoint
+        for key, value in data.items():
+            if hasattr(checkpoint, key) and key != "path":
+                setattr(checkpoint, key, value)
+        return checkpoint
+
+    def to_dict(self) -> dict:
+        return {key: value for key, value in vars(self).items() if key != "path"}
+
+    def save(self):
+        """Save checkpoint, file is replaced atomically so crash can't leave it half-written"""
+        self.updated_at = datetime.now().isoformat()
+        self.prune_comments()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def prune_comments(self):
+        """Keep last comment ids of the newest posts only, so checkpoint stays small.
+        Threads of older posts are fetched whole if they are ever scraped again."""
+        limit = Config.checkpoint_comment_posts
+        if limit and len(self.comments) > limit:
+            newest = sorted(self.comments, key=int, reverse=True)[:limit]
+            self.comments = {post_id: self.comments[post_id] for post_id in newest}
+
+    def connects(self, low: int, high: int) -> bool:
+        """Check if range of message ids (inclusive) can be merged into scraped range"""
+        if self.max_id is None or self.min_id is None:
+            return True
+        return low <= self.max_id + 1 and high >= self.min_id - 1
+
+    def merge_range(self, low: int, high: int) -> bool:
+        """Merge range of scraped message ids (inclusive) into checkpoint.\n
+        Range is merged only if checkpoint is empty or range overlaps/touches scraped range.
+        :returns: True if range was merged
+        """
+        if low is None or high is None or low > high:
+            return False
+        if self.max_id is None or self.min_id is None:
+            self.min_id, self.max_id = low, high
+            return True
+        if self.connects(low, high):
+            self.min_id, self.max_id = min(self.min_id, low), max(self.max_id, high)
+            return True
+        logging.warning(f"[Checkpoint] Range {low}..{high} doesn't connect to scraped range "
+                        f"{self.min_id}..{self.max_id}, not saved")
+        return False
+
+    def update_admin_log(self, event_id: int):
+        if event_id is not None and (self.admin_log_id is None or event_id > self.admin_log_id):
+            self.admin_log_id = event_id
@@ -0,0 +1,175 @@
+"""Non-interactive batch entry point, meant for cron and orchestration.
+
+Usage:
+    python -m bot.cli durov telegram --limit 1000 --skip participants
+    python -m bot.cli --job job.json
+    python -m bot.cli durov --inspect
+
+Job file is JSON with the same options as command line (command line wins):
+    {"targets": ["durov", {"target": "telegram", "priority": 1}], "stages": ["messages"],
+     "limit": 1000, "full": false, "concurrency": 4, "config": {"download_media": false},
+     "filters": {"since": "2024-01-01", "from_user": "durov", "search": "ton", "media": "photo"}}
+
+Exit code is 0 when every target is done, 1 when some target failed (or was scraped partially),
+2 on invalid arguments.
+"""
+import argparse
+import json
+import os
+import sys
+from bot.settings import Config, STAGES, ADMIN_LOG_EVENTS
+
+FILTERS = ("since", "until", "from_user", "search", "media", "max_id")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape telegram channels without interactive prompts.")
+    parser.add_argument("target", nargs="*", help="@username of channels to scrape")
+    parser.add_argument("--targets", help="file with targets, one \"username [priority]\" per line")
+    parser.add_argument("--job", help="JSON job file (see module docstring)")
+    parser.add_argument("--sessions", nargs="+", default=None, metavar="SESSION",
+                        help="session files of several accounts, targets are spread across them")
+    parser.add_argument("--concurrency", type=int, default=None, help="number of targets scraped at the same time")
+    parser.add_argument("--limit", type=int, default=None, help="max number of messages for targets scraped for the first time")
+    parser.add_argument("--full", action="store_true", default=None, help="scrape whole history instead of messages newer than last run")
+    parser.add_argument("--backfill", action="store_true", default=None,
+                        help="fetch whole history by concurrent id range shards (for targets without min_id)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=None, help="stages to run (all by default)")
+    parser.add_argument("--skip", nargs="+", choices=STAGES, default=[], help="stages to skip, e.g. --skip participants admin_logs")
+    parser.add_argument("--admin-log-events", nargs="+", choices=ADMIN_LOG_EVENTS, default=None,
+                        help="fetch only these admin log event types, e.g. --admin-log-events ban delete")
+    filters = parser.add_argument_group("message filters", "applied by telegram where possible, filtered runs don't update checkpoint")
+    filters.add_argument("--since", help="messages sent at or after this ISO date")
+    filters.add_argument("--until", help="messages sent before this ISO date")
+    filters.add_argument("--from-user", help="messages of one sender (@username or id)")
+    filters.add_argument("--search", help="messages containing this text")
+    filters.add_argument("--media", help="photo, video, photo_video, document, url, gif, voice, music, round, geo, pinned, text or sticker")
+    filters.add_argument("--max-id", type=int, help="messages older than this id")
+    parser.add_argument("--db", action="store_true", default=None, help="also save messages to PostgreSQL")
+    parser.add_argument("--sqlite", nargs="?", const=True, default=None, metavar="PATH",
+                        help="also save everything to SQLite archive (Config.sqlite_path by default)")
+    parser.add_argument("--log-level", default=None, help="DEBUG, INFO, WARNING...")
+    parser.add_argument("--inspect", action="store_true", help="print checkpoint and status of targets and exit")
+    return parser.parse_args(argv)
+
+
+def load_job(path: str) -> dict:
+    """Read JSON job file, targets are normalized to list of (target, priority) tuples"""
+    with open(path, 'r', encoding='utf-8') as f:
+        job = json.load(f)
+    targets = []
+    for target in job.get("targets", []):
+        if isinstance(target, dict):
+            targets.append((target["target"], int(target.get("priority", 0))))
+        else:
+            targets.append((target, 0))
+    job["targets"] = targets
+    return job
+
+
+def apply_config(overrides: dict):
+    """Set Config attributes from job file, unknown names are rejected"""
+    for name, value in overrides.items():
+        if name.startswith("_") or not hasattr(Config, name):
+            raise ValueError(f"Unknown config option: {name}")
+        setattr(Config, name, value)
+
+
+def inspect_targets(targets: list[str]) -> dict:
+    """Checkpoint and last status of each target, read from disk without connecting to telegram"""
+    from .checkpoint import Checkpoint
+
+    res = {}
+    for target in targets:
+        jsons_folder = Config.get_folders(target)["jsons_folder"]
+        status_path = os.path.join(jsons_folder, "status.json")
+        status = None
+        if os.path.exists(status_path):
+            with open(status_path, 'r', encoding='utf-8') as f:
+                status = json.load(f)
+        res[target] = {
+            "checkpoint": Checkpoint.load(os.path.join(jsons_folder, "checkpoint.json")).to_dict(),
+            "status": status,
+        }
+    return res
+
+
+async def run(targets: list[tuple[str, int]], concurrency=None, limit=None, full=False, stages=None,
+              filters: dict = None) -> dict:
+    from .scheduler import Scheduler
+    from .filters import MessageFilter
+    from .metrics import metrics
+
+    scheduler = Scheduler(targets, concurrency=concurrency, limit=limit, only_new=not full, stages=stages,
+                          filters=MessageFilter(**filters) if filters else None)
+    metrics.start_exporter()
+    try:
+        return await scheduler.run()
+    finally:
+        await metrics.stop_exporter()
+        if scheduler.pool is not None:
+            await scheduler.pool.disconnect()
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    job = load_job(args.job) if args.job else {}
+
+    targets = list(job.get("targets", []))
+    if args.targets:
+        from .scheduler import load_targets
+        targets += load_targets(args.targets)
+    targets += [(target, 0) for target in args.target]
+    if not targets:
+        print("No targets given, pass @username, --targets or --job", file=sys.stderr)
+        return 2
+
+    if args.inspect:
+        print(json.dumps(inspect_targets([target for target, _ in targets]), ensure_ascii=False, indent=4))
+        return 0
+
+    try:
+        apply_config(job.get("config", {}))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.backfill is not None:
+        Config.backfill = args.backfill
+    if args.sessions is not None:
+        Config.sessions = args.sessions
+    if args.admin_log_events is not None:
+        Config.admin_log_events = args.admin_log_events
+    if args.db is not None:
+        Config.save_to_db = args.db
+    if args.sqlite is not None:
+        Config.save_to_sqlite = True
+        if args.sqlite is not True:
+            Config.sqlite_path = args.sqlite
+    Config.setup_logging(args.log_level or job.get("log_level"))
+
+    stages = args.stages or job.get("stages") or Config.scrape_stages
+    stages = [stage for stage in stages if stage not in args.skip + job.get("skip", [])]
+    Config.scrape_stages = stages
+
+    filters = dict(job.get("filters", {}))
+    filters.update({name: getattr(args, name) for name in FILTERS if getattr(args, name) is not None})
+    unknown = set(filters) - set(FILTERS)
+    if unknown:
+        print(f"Unknown filters: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    import asyncio  # imported here, --help and --inspect don't need it
+
+    results = asyncio.run(run(targets,
+                              concurrency=args.concurrency or job.get("concurrency"),
+                              limit=args.limit if args.limit is not None else job.get("limit"),
+                              full=args.full if args.full is not None else job.get("full", False),
+                              stages=stages,
+                              filters=filters))
+    for target, result in results.items():
+        print(f"{target}: {result}")
+    return 0 if all(result == "done" for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
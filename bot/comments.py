@@ -0,0 +1,101 @@
+import asyncio
+from bot.settings import Config, logging
+from .ratelimit import limited
+from .metrics import metrics
+from .records import Comment
+
+
+def comment_to_record(comment, post_id: int) -> Comment:
+    """Build comment record"""
+    return Comment(
+        id=comment.id,
+        text=comment.text,
+        date=comment.date.isoformat(),
+        changed_at=comment.edit_date.isoformat() if comment.edit_date and comment.edit_date != comment.date else None,
+        user_id=comment.from_id.user_id if comment.from_id else None,
+        post_id=post_id,
+    )
+
+
+class CommentFetcher:
+    """Comment fetching stage, N workers fetch comment threads concurrently, fed by a bounded queue.\n
+    Each post gets its own list of comments. Only comments newer than the last one seen in
+    earlier runs (checkpoint.comments) are fetched, at most Config.max_comments_per_post per post.\n
+    **Usage:**
+        fetcher = CommentFetcher(bot)
+        fetcher.start()
+        await fetcher.submit(message.id, msg_data)
+        await fetcher.close()
+    """
+    def __init__(self, scraper, workers: int = None, queue_size: int = None, max_comments: int = None):
+        self.scraper = scraper
+        self.workers = workers or Config.comment_workers
+        self.max_comments = max_comments or Config.max_comments_per_post
+        self.queue = asyncio.Queue(maxsize=queue_size or Config.comments_queue_size)
+        self._tasks = []
+
+    def start(self):
+        """Start comment workers"""
+        for n in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(n)))
+        logging.info(f"Started {self.workers} comment workers")
+
+    async def submit(self, post_id: int, record: dict = None):
+        """Put post into comment queue.\n
+        When its thread is fetched, record['comments'] is set to list of new comments (or None).
+        :param post_id: id of the post
+        :param record: dict with message data (optional), will be updated by worker
+        """
+        await self.queue.put((post_id, record))
+
+    async def _worker(self, n: int):
+        while True:
+            post_id, record = await self.queue.get()
+            try:
+                comments = await self.fetch_thread(post_id)
+                if record is not None:
+                    record['comments'] = comments or None
+            except Exception as e:
+                logging.warning(f"[worker {n}] Failed to fetch comments of post {post_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    @metrics.timed("comment_fetching")
+    async def fetch_thread(self, post_id: int) -> list:
+        """Fetch comments of one post, newer than the last comment seen in earlier runs.\n
+        Every comment is written to "comments" output stream with post_id.
+        :returns: list with new comments
+        """
+        checkpoint = self.scraper.checkpoint
+        min_id = checkpoint.comments.get(str(post_id), 0)
+        comments = []
+        complete = True
+        def comments_from(last=None):
+            limit = self.max_comments - len(comments) if self.max_comments else None
+            return self.scraper.client.iter_messages(self.scraper.target, reply_to=post_id, min_id=min_id,
+                                                     offset_id=last.id if last else 0, limit=limit)
+
+        async for comment in limited(comments_from(), "get_messages", resume=comments_from):
+            if Config.stop_event.is_set():
+                complete = False
+                break
+            comment_data = comment_to_record(comment, post_id)
+            comments.append(comment_data)
+            await self.scraper._emit("comments", comment_data)
+
+        metrics.inc("comments", len(comments))
+        # Comments come newest first, so the last seen id moves only when the thread was fetched completely
+        # (or up to max_comments), otherwise older unfetched replies would be skipped forever
+        if comments and complete:
+            checkpoint.comments[str(post_id)] = max(max(c.id for c in comments), min_id)
+        logging.debug("Fetched %d new comments of post %d", len(comments), post_id)
+        return comments
+
+    async def close(self):
+        """Wait until all queued threads are fetched and stop workers"""
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        logging.info("All comments fetched")
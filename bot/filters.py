@@ -0,0 +1,95 @@
+from datetime import datetime, timezone
+from telethon.tl import types
+
+# Media filters telegram applies on server side
+SERVER_MEDIA_FILTERS = {
+    "photo": types.InputMessagesFilterPhotos,
+    "video": types.InputMessagesFilterVideo,
+    "photo_video": types.InputMessagesFilterPhotoVideo,
+    "document": types.InputMessagesFilterDocument,
+    "url": types.InputMessagesFilterUrl,
+    "gif": types.InputMessagesFilterGif,
+    "voice": types.InputMessagesFilterVoice,
+    "music": types.InputMessagesFilterMusic,
+    "round": types.InputMessagesFilterRoundVideo,
+    "geo": types.InputMessagesFilterGeo,
+    "pinned": types.InputMessagesFilterPinned,
+}
+
+# Media filters without server side equivalent, checked on each fetched message
+CLIENT_MEDIA_FILTERS = {
+    "text": lambda message: message.media is None,
+    "sticker": lambda message: any(type(attribute).__name__ == "DocumentAttributeSticker"
+                                   for attribute in getattr(getattr(message.media, "document", None), "attributes", None) or []),
+}
+
+MEDIA_FILTERS = tuple(SERVER_MEDIA_FILTERS) + tuple(CLIENT_MEDIA_FILTERS)
+
+
+def parse_date(value) -> datetime | None:
+    """Parse ISO date (or datetime), naive values are treated as UTC"""
+    if value is None or isinstance(value, datetime):
+        date = value
+    else:
+        date = datetime.fromisoformat(value)
+    if date is not None and date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
+
+
+class MessageFilter:
+    """Filter of fetched messages, translated to server side parameters of iter_messages() where possible:
+    until -> offset_date, from_user, search, media -> filter=InputMessagesFilter*, max_id.
+    Messages are fetched from the newest one, so `since` stops iteration at the first older message.
+    Media types telegram can't filter (see CLIENT_MEDIA_FILTERS) are checked on client side.\n
+    **Usage:**
+        filters = MessageFilter(since="2024-01-01", from_user="durov", media="photo")
+        await bot.fetch_messages(limit=None, filters=filters)
+    """
+    __slots__ = ("since", "until", "from_user", "search", "media", "max_id")
+
+    def __init__(self, since=None, until=None, from_user=None, search: str = None, media: str = None,
+                 max_id: int = None):
+        if media is not None and media not in MEDIA_FILTERS:
+            raise ValueError(f"Unknown media filter: {media}, expected one of {', '.join(MEDIA_FILTERS)}")
+        self.since = parse_date(since)
+        self.until = parse_date(until)
+        self.from_user = int(from_user) if isinstance(from_user, str) and from_user.lstrip("-").isdigit() else from_user
+        self.search = search
+        self.media = media
+        self.max_id = max_id
+
+    def __bool__(self):
+        return any(getattr(self, field) is not None for field in self.__slots__)
+
+    def __repr__(self):
+        return f"MessageFilter({', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__ if getattr(self, field) is not None)})"
+
+    def to_kwargs(self) -> dict:
+        """Server side parameters of client.iter_messages()"""
+        kwargs = {}
+        if self.until is not None:
+            kwargs["offset_date"] = self.until
+        if self.from_user is not None:
+            kwargs["from_user"] = self.from_user
+        if self.search:
+            kwargs["search"] = self.search
+        if self.media in SERVER_MEDIA_FILTERS:
+            kwargs["filter"] = SERVER_MEDIA_FILTERS[self.media]
+        if self.max_id:
+            kwargs["max_id"] = self.max_id
+        return kwargs
+
+    def server_only(self) -> bool:
+        """True when every condition is applied by telegram (`since` only stops iteration)"""
+        return self.media not in CLIENT_MEDIA_FILTERS
+
+    def is_past(self, message) -> bool:
+        """True when message is older than `since`, so no further (older) message can match"""
+        return self.since is not None and message.date < self.since
+
+    def matches(self, message) -> bool:
+        """Client side checks of conditions which can't be pushed to server"""
+        if self.media in CLIENT_MEDIA_FILTERS and not CLIENT_MEDIA_FILTERS[self.media](message):
+            return False
+        return True
@@ -0,0 +1,106 @@
+import atexit
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+from bot.settings import Config
+
+LOG_FORMAT = "[%(asctime)s][%(name)s][%(funcName)s] %(levelname)s - %(message)s"
+LOG_DATE_FORMAT = "%d.%m, %H:%M:%S"
+
+_listener = None
+
+
+class SampledFilter(logging.Filter):
+    """Lets through at most `rate` DEBUG records per second from one function, the rest are dropped
+    before they are formatted. The first record of the next second reports how many were dropped.
+    Records of other levels always pass.
+    """
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        self._windows = {}  # (module, function) -> [second, passed, dropped]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        key = (record.module, record.funcName)
+        second = int(record.created)
+        window = self._windows.get(key)
+        if window is None or window[0] != second:
+            dropped = window[2] if window else 0
+            window = self._windows[key] = [second, 0, 0]
+            if dropped:
+                record.msg = f"{record.msg} (+{dropped} similar debug lines dropped)"
+        if window[1] >= self.rate:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+
+class _LazyQueueHandler(QueueHandler):
+    """QueueHandler which leaves formatting to the listener thread (stock one formats in the caller)"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(level: str, filename: str):
+    """Log to file, from background thread when Config.log_queue is on.\n
+    Event loop only puts records into a queue, QueueListener formats and writes them.
+    DEBUG records are sampled by Config.log_debug_rate. Does nothing if logging is already configured.\n
+    **Usage:** setup_logging("INFO", "logs.log")
+    """
+    global _listener
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    root.setLevel(getattr(logging, level.upper()))
+
+    file_handler = logging.FileHandler(filename, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+    if Config.log_queue:
+        handler = _LazyQueueHandler(queue.SimpleQueue())
+        _listener = QueueListener(handler.queue, file_handler)
+        _listener.start()
+        atexit.register(stop_logging)
+    else:
+        handler = file_handler
+    if Config.log_debug_rate:
+        handler.addFilter(SampledFilter(Config.log_debug_rate))
+    root.addHandler(handler)
+
+
+def stop_logging():
+    """Write out queued records and stop listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class Progress:
+    """Periodic INFO summary of a long loop, used instead of one log line per item.\n
+    **Usage:**
+        progress = Progress("fetch_messages", "messages")
+        progress.update()  # once per item
+        progress.finish()
+    """
+    def __init__(self, name: str, unit: str, interval: float = None):
+        self.name = name
+        self.unit = unit
+        self.interval = interval or Config.log_progress_interval
+        self.count = 0
+        self.started_at = self._logged_at = time.monotonic()
+
+    def update(self, count: int = 1):
+        self.count += count
+        now = time.monotonic()
+        if now - self._logged_at >= self.interval:
+            self._logged_at = now
+            logging.info("[%s] %d %s (%.1f/s)", self.name, self.count, self.unit, self.count / (now - self.started_at),
+                         stacklevel=2)
+
+    def finish(self):
+        elapsed = time.monotonic() - self.started_at
+        logging.info("[%s] Finished, %d %s in %.1fs", self.name, self.count, self.unit, elapsed, stacklevel=2)
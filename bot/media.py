@@ -0,0 +1,247 @@
+import asyncio
+import json
+import math
+import os
+import time
+from telethon.errors import FloodWaitError
+from bot.settings import Config, logging
+from .utils import safe_call
+from .ratelimit import get_limiter, backoff_delay
+from .media_store import MediaStore, get_media_store
+from .metrics import metrics
+
+
+def media_size(media) -> int | None:
+    """Size of document in bytes, None for photos and other media without known size"""
+    document = getattr(media, "document", None)
+    return getattr(document, "size", None) or None
+
+
+class MediaDownloader:
+    """Media download stage, runs N concurrent downloads fed by a bounded queue.\n
+    Message loop only puts work into the queue, so it won't stall behind one big file.
+    When the queue is full, submit() waits until one of workers takes a job.
+    Files already in shared media store are linked instead of downloaded.
+    Documents bigger than Config.max_media_size are skipped, bigger than Config.defer_media_size are
+    downloaded after all the others (when the downloader is closed), big documents are downloaded
+    in resumable chunks (see ChunkedDownload).\n
+    **Usage:**
+        downloader = MediaDownloader(client)
+        downloader.start()
+        await downloader.submit(message, path, msg_data)
+        await downloader.close()
+    """
+    def __init__(self, client=None, workers: int = None, queue_size: int = None):
+        self.client = client or Config.client
+        self.workers = workers or Config.media_workers
+        self.queue = asyncio.Queue(maxsize=queue_size or Config.media_queue_size)
+        self.deferred = []  # big downloads, queued when the downloader is closed
+        self._tasks = []
+
+    def start(self):
+        """Start download workers"""
+        for n in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(n)))
+        logging.info(f"Started {self.workers} media download workers")
+
+    async def submit(self, message, path: str, record: dict, on_done=None) -> asyncio.Future:
+        """Put message media into download queue.\n
+        When download is finished, record['media'] is set to saved file path (or None if download failed).
+        :param message: telethon message with media
+        :param path: path where media will be saved
+        :param record: dict with message data, will be updated by worker
+        :param on_done: coroutine function (optional), awaited with file path when download is finished,
+            close() waits for it too
+        :returns: future, resolved with file path when download is finished
+        """
+        future = asyncio.get_running_loop().create_future()
+        size = media_size(message.media)
+        if size and Config.max_media_size and size > Config.max_media_size:
+            logging.info(f"Media of message {message.id} ({size} bytes) is bigger than max_media_size, skipped")
+            metrics.inc("media_skipped")
+            record['media'] = None
+            future.set_result(None)
+            if on_done is not None:
+                await on_done(None)
+        elif size and Config.defer_media_size and size > Config.defer_media_size:
+            self.deferred.append((message, path, record, future, on_done))
+        else:
+            await self.queue.put((message, path, record, future, on_done))
+        return future
+
+    async def _worker(self, n: int):
+        while True:
+            message, path, record, future, on_done = await self.queue.get()
+            file_path = None
+            try:
+                if not Config.stop_event.is_set():
+                    logging.debug("[worker %d] Downloading media of message %d", n, message.id)
+                    async with metrics.timer("media_download"):
+                        file_path = await self._download(message, path)
+                    if file_path and os.path.exists(file_path):
+                        metrics.inc("media_files")
+                        metrics.inc("media_bytes", os.path.getsize(file_path))
+            except Exception as e:
+                logging.warning(f"[worker {n}] Failed to download media of message {message.id}: {e}")
+            finally:
+                record['media'] = file_path if file_path else None
+                if not future.done():
+                    future.set_result(record['media'])
+                if on_done is not None:
+                    try:
+                        await on_done(record['media'])
+                    except Exception as e:
+                        logging.warning(f"[worker {n}] Failed to write message {message.id}: {e}")
+                self.queue.task_done()
+
+    async def _download(self, message, path: str) -> str | None:
+        size = media_size(message.media)
+
+        async def download(file):
+            if size and size >= Config.chunked_download_min_size:
+                return await ChunkedDownload(self.client, message.media.document, file, size).run()
+            return await safe_call(lambda: message.download_media(file=file), "media_downloader",
+                                   rpc_class="download", use_slot=False)
+
+        store = get_media_store()
+        if store is None:
+            return await download(path)
+        return await store.fetch(MediaStore.media_key(message.media), path, download)
+
+    async def close(self):
+        """Wait until all queued (and then deferred) downloads are finished and stop workers"""
+        await self.queue.join()
+        if self.deferred:
+            logging.info(f"Downloading {len(self.deferred)} deferred big files")
+            deferred, self.deferred = self.deferred, []
+            for job in deferred:
+                await self.queue.put(job)
+            await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        logging.info("All media downloads finished")
+
+
+class ChunkedDownload:
+    """Resumable download of one big document by chunks (iter_download).\n
+    Data is written to <path>.part, progress of each byte range to <path>.part.json, so interrupted
+    download (stop request, dropped connection, crash) continues from where it stopped instead of
+    starting over. Files of at least 2 * Config.download_part_min_size are split into up to
+    Config.download_parts ranges fetched in parallel. Failed range is retried from its last chunk.
+    Finished file is checked against expected size before it's moved to <path>.\n
+    **Usage:** path = await ChunkedDownload(client, message.media.document, "video.mp4", size).run()
+    """
+    def __init__(self, client, document, path: str, size: int, chunk_size: int = None, parts: int = None):
+        self.client = client
+        self.document = document
+        self.path = path
+        self.size = size
+        self.chunk_size = chunk_size or Config.download_chunk_size
+        self.parts = parts or max(1, min(Config.download_parts, size // Config.download_part_min_size))
+        self.part_path = path + ".part"
+        self.state_path = path + ".part.json"
+        self.ranges = []  # {"start", "end", "next"}: bytes [start, next) are already written
+        self._saved_at = 0.0
+
+    def plan(self) -> list[dict]:
+        """Split file into ranges aligned to chunk size"""
+        chunks = math.ceil(self.size / self.chunk_size)
+        per_part = math.ceil(chunks / self.parts)
+        return [{"start": start, "end": min(self.size, start + per_part * self.chunk_size), "next": start}
+                for start in range(0, self.size, per_part * self.chunk_size)]
+
+    def load_state(self):
+        """Continue ranges of interrupted download of the same file, otherwise start over"""
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get("size") == self.size and os.path.exists(self.part_path):
+                self.ranges = state["ranges"]
+                done = sum(part["next"] - part["start"] for part in self.ranges)
+                logging.info(f"Resuming download of {self.path} at {done} of {self.size} bytes")
+                return
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"[ChunkedDownload] Couldn't read {self.state_path}, starting over: {e}")
+        self.ranges = self.plan()
+        with open(self.part_path, 'wb'):
+            pass
+
+    def save_state(self, f=None):
+        if f is not None:
+            f.flush()  # state must never claim bytes which are not written yet
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as state_file:
+            json.dump({"size": self.size, "ranges": self.ranges}, state_file)
+        os.replace(tmp_path, self.state_path)
+        self._saved_at = time.monotonic()
+
+    async def run(self) -> str | None:
+        """Download the file.
+        :returns: path, or None if download was stopped, failed or has wrong size (it's resumed next time)
+        """
+        self.load_state()
+        with open(self.part_path, 'r+b') as f:
+            try:
+                results = await asyncio.gather(*(self._fetch_range(part, f) for part in self.ranges
+                                                  if part["next"] < part["end"]), return_exceptions=True)
+            finally:
+                self.save_state(f)
+        for result in results:
+            if isinstance(result, Exception):
+                logging.warning(f"[ChunkedDownload] Range of {self.path} failed, will be resumed: {result}")
+        if any(part["next"] < part["end"] for part in self.ranges):
+            return None
+
+        written = os.path.getsize(self.part_path)
+        if written != self.size:
+            logging.warning(f"[ChunkedDownload] {self.path} has {written} bytes instead of {self.size}, starting over next time")
+            os.remove(self.part_path)
+            os.remove(self.state_path)
+            return None
+        os.replace(self.part_path, self.path)
+        os.remove(self.state_path)
+        return self.path
+
+    async def _fetch_range(self, part: dict, f):
+        """Write chunks of one range, stops at chunk boundary when Config.stop_event is set"""
+        attempts = 0
+        while part["next"] < part["end"] and not Config.stop_event.is_set():
+            limiter = get_limiter()
+            await limiter.acquire("download")
+            try:
+                requests = math.ceil((part["end"] - part["next"]) / self.chunk_size)
+                iterator = self.client.iter_download(self.document, offset=part["next"], limit=requests,
+                                                     request_size=self.chunk_size, file_size=self.size)
+                async for chunk in iterator:
+                    if Config.stop_event.is_set():
+                        return
+                    chunk = chunk[:part["end"] - part["next"]]
+                    f.seek(part["next"])
+                    f.write(chunk)
+                    part["next"] += len(chunk)
+                    metrics.inc("media_chunks")
+                    if time.monotonic() - self._saved_at > Config.download_state_interval:
+                        self.save_state(f)
+                    if part["next"] >= part["end"]:
+                        break
+                else:
+                    if part["next"] < part["end"]:
+                        raise IOError(f"file ended at {part['next']} bytes, expected {part['end']}")
+            except FloodWaitError as e:
+                if e.seconds > Config.max_flood_wait:
+                    raise
+                limiter.pause("download", e.seconds)
+                print(f"[FloodWait] - [media_downloader] Too many requests sent! Waiting for {e.seconds} seconds...")
+            except Exception as e:
+                attempts += 1
+                if attempts > Config.max_attempts:
+                    raise
+                delay = backoff_delay(attempts)
+                limiter.count("download", "retries")
+                logging.warning(f"[ChunkedDownload] {self.path} failed at {part['next']} bytes: {e}, "
+                                f"retrying in {delay:.1f} seconds")
+                await asyncio.sleep(delay)
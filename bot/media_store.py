@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+from bot.settings import Config, logging
+
+
+class MediaStore:
+    """Content-addressed store for media and avatars, shared by all targets.\n
+    Files are keyed by telegram photo/document id (e.g. "photo_5312..."), kept in sharded
+    subdirectories (ab/cd/<key>.<ext>) and linked (hard link, symlink or copy) to per-target paths.
+    index.jsonl in store folder makes "already have it" lookups O(1), so the same photo forwarded
+    into many channels or avatar of a user who changed name is downloaded only once.
+    With Config.media_store_hash files are also deduplicated by sha256 of their content.\n
+    **Usage:**
+        store = get_media_store()
+        path = store.get(MediaStore.media_key(message.media))
+    """
+    def __init__(self, root: str = None, hash_content: bool = None):
+        self.root = root or Config.media_store_folder
+        self.hash_content = Config.media_store_hash if hash_content is None else hash_content
+        self.index_path = os.path.join(self.root, "index.jsonl")
+        self._index = {}  # key -> entry
+        self._hashes = {}  # sha256 -> path
+        self._in_flight = {}  # key -> future of download in progress, resolved with stored path (or None)
+        os.makedirs(self.root, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._index[entry["key"]] = entry
+                if entry.get("sha256"):
+                    self._hashes[entry["sha256"]] = entry["path"]
+        logging.info(f"Loaded {len(self._index)} entries of media store index")
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    @staticmethod
+    def media_key(media) -> str | None:
+        """Build store key of message media, None if media has no photo/document"""
+        photo = getattr(media, "photo", None)
+        if photo is not None and getattr(photo, "id", None):
+            return f"photo_{photo.id}"
+        document = getattr(media, "document", None)
+        if document is not None and getattr(document, "id", None):
+            return f"document_{document.id}"
+        return None
+
+    @staticmethod
+    def avatar_key(entity) -> str | None:
+        """Build store key of entity profile photo, None if entity has no photo"""
+        photo = getattr(entity, "photo", None)
+        photo_id = getattr(photo, "photo_id", None) or getattr(entity, "photo_id", None)
+        return f"avatar_{photo_id}" if photo_id else None
+
+    def path_for(self, key: str, extension: str = "") -> str:
+        """Sharded path of file in store"""
+        digest = hashlib.md5(key.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{key}{extension}")
+
+    def get(self, key: str) -> str | None:
+        """Path of stored file, None if it isn't stored (or was deleted from disk)"""
+        if key is None:
+            return None
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        if not os.path.exists(entry["path"]):
+            del self._index[key]
+            return None
+        return entry["path"]
+
+    def add(self, key: str, path: str) -> str:
+        """Register downloaded file in store.\n
+        If content hashing is on and the same content is already stored, new file is replaced by link to it.
+        :returns: path of stored file
+        """
+        entry = {"key": key, "path": path, "size": os.path.getsize(path)}
+        if self.hash_content:
+            sha256 = self._sha256(path)
+            entry["sha256"] = sha256
+            existing = self._hashes.get(sha256)
+            if existing and existing != path and os.path.exists(existing):
+                os.remove(path)
+                self.link(existing, path)
+            else:
+                self._hashes[sha256] = path
+        self._index[key] = entry
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return path
+
+    @staticmethod
+    def _sha256(path: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def link(stored_path: str, target_path: str) -> str:
+        """Make stored file available under per-target path (hard link, symlink or copy as the last resort)"""
+        if os.path.exists(target_path):
+            return target_path
+        os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+        try:
+            os.link(stored_path, target_path)
+        except OSError:
+            try:
+                os.symlink(os.path.abspath(stored_path), target_path)
+            except OSError:
+                shutil.copy2(stored_path, target_path)
+        return target_path
+
+    async def fetch(self, key: str, target_path: str, download) -> str | None:
+        """Get file from store or download it into store, then link it to target_path.
+        Concurrent requests of the same key wait for the first download instead of starting their own.
+        :param key: store key (media_key() or avatar_key()), without key file is downloaded directly to target_path
+        :param target_path: per-target path of the file
+        :param download: async function, which downloads file to given path and returns saved path (or None)
+        :returns: target_path or None if download failed
+        """
+        if key is None:
+            return await download(target_path)
+
+        stored_path = self.get(key)
+        if stored_path is not None:
+            logging.debug("[MediaStore] %s is already stored, skipping download", key)
+        elif key in self._in_flight:
+            logging.debug("[MediaStore] %s is being downloaded, waiting for it", key)
+            stored_path = await asyncio.shield(self._in_flight[key])
+        else:
+            stored_path = await self._download(key, target_path, download)
+        if stored_path is None:
+            return None
+        return self.link(stored_path, target_path)
+
+    async def _download(self, key: str, target_path: str, download) -> str | None:
+        """Download file into store, waiting fetch() calls of the same key get its stored path"""
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        stored_path = None
+        try:
+            extension = os.path.splitext(target_path)[1]
+            path = self.path_for(key, extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            saved_path = await download(path)
+            if saved_path and os.path.exists(saved_path):
+                stored_path = self.add(key, saved_path)
+        finally:
+            del self._in_flight[key]
+            future.set_result(stored_path)
+        return stored_path
+
+
+_media_store = None
+
+
+def get_media_store() -> MediaStore | None:
+    """Media store shared by all Scraper instances, None if Config.use_media_store is turned off"""
+    global _media_store
+    if _media_store is None and Config.use_media_store:
+        _media_store = MediaStore()
+    return _media_store
@@ -0,0 +1,150 @@
+import asyncio
+import os
+from collections import deque
+from telethon.errors import FloodWaitError
+from bot.settings import Config, logging
+from .ratelimit import get_limiter, limited
+from .metrics import metrics
+from .logs import Progress
+from .records import Participant
+
+
+def member_to_record(user) -> Participant:
+    """Build participant record (avatar is filled in later)"""
+    return Participant(user_id=user.id, username=user.username, first_name=user.first_name,
+                       last_name=user.last_name)
+
+
+class MemberExporter:
+    """Streaming export of group/channel participants.\n
+    Members are fetched page by page with iter_participants(), so the whole list is never kept in memory.
+    Plain listing returns at most Config.members_listing_cap members, so for bigger groups search passes
+    (one per character of Config.members_search_alphabet, extended by one more character while a query
+    still hits the cap) fetch the rest. Members are deduplicated by id across passes and written to
+    "participants" output stream as soon as their avatar is saved. Avatars are downloaded by
+    Config.avatar_workers workers in background.\n
+    stream() yields members in the same order, the next page is requested only when the consumer
+    asks for more members than are ready.\n
+    **Usage:**
+        exporter = MemberExporter(bot)
+        count = await exporter.run(expected=await bot.participants_count())
+        async for member in MemberExporter(bot).stream(): ...
+    """
+    def __init__(self, scraper, workers: int = None, queue_size: int = None, collect: bool = False):
+        self.scraper = scraper
+        self.workers = workers or Config.avatar_workers
+        self.queue = asyncio.Queue(maxsize=queue_size or Config.avatar_queue_size)
+        self.collect = collect
+        self.members = []  # filled in only when collect is turned on
+        self.seen = set()
+        self.ready = deque()  # members with saved avatars, not yielded by stream() yet
+        self.found = 0  # participants returned by the last pass (including already seen ones)
+        self.failed = []  # queries of passes which failed after all attempts
+        self.progress = Progress("get_members", "members")
+        self._tasks = []
+
+    async def run(self, expected: int = None) -> int:
+        """Export all members of the target.
+        :param expected: number of participants reported by telegram (optional), search stops when it's reached
+        :returns: number of exported members
+        """
+        async for member in self.stream(expected):
+            if self.collect:
+                self.members.append(member)
+        return len(self.seen)
+
+    async def stream(self, expected: int = None):
+        """Export all members of the target, yielding each one as soon as its avatar is saved.
+        :param expected: number of participants reported by telegram (optional), search stops when it's reached
+        """
+        for n in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(n)))
+        try:
+            async for user in self._users(expected):
+                await self._add(user)
+                while self.ready:
+                    yield self.ready.popleft()
+            await self.queue.join()
+            while self.ready:
+                yield self.ready.popleft()
+            if self.failed:
+                raise RuntimeError(f"Members export is incomplete, search passes {self.failed} failed "
+                                   f"after {Config.max_attempts} attempts")
+        finally:
+            await self.queue.join()
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks.clear()
+            self.progress.finish()
+
+    async def _users(self, expected: int = None):
+        """New (not seen yet) users of the plain listing, followed by search passes if listing hits the cap"""
+        async for user in self._pass(""):
+            yield user
+        if not (len(self.seen) >= Config.members_listing_cap or (expected and len(self.seen) < expected)):
+            return
+        logging.info(f"Listing returned {len(self.seen)} of {expected or '?'} members, starting search passes")
+        queries = deque(Config.members_search_alphabet)
+        while queries and not Config.stop_event.is_set():
+            if expected and len(self.seen) >= expected:
+                break
+            query = queries.popleft()
+            async for user in self._pass(query):
+                yield user
+            if self.found >= Config.members_listing_cap and len(query) < Config.members_search_depth:
+                queries.extend(query + char for char in Config.members_search_alphabet)
+
+    async def _pass(self, query: str):
+        """Iterate participants matching search query, yields only new ones.\n
+        Pass interrupted by FloodWait is repeated from the start when the pause is over, already seen members
+        are skipped. Query of pass which fails every attempt is added to self.failed.
+        Number of participants returned by telegram (including already seen ones) is kept in self.found.
+        """
+        for attempt in range(Config.max_attempts):
+            self.found = 0
+            try:
+                iterator = self.scraper.client.iter_participants(self.scraper.target, search=query)
+                async for user in limited(iterator, "get_participants", page_size=200):
+                    if Config.stop_event.is_set():
+                        logging.info("Interrupted by user")
+                        break
+                    self.found += 1
+                    if user.id not in self.seen:
+                        self.seen.add(user.id)
+                        yield user
+                return
+            except FloodWaitError as e:
+                if e.seconds > Config.max_flood_wait:
+                    raise
+                # limited() has paused get_participants, wait for the pause to end before the next attempt
+                print(f"[FloodWait] - [get_members] Too many requests sent! Waiting for {e.seconds} seconds...")
+                await get_limiter().acquire("get_participants")
+        self.failed.append(query)
+        logging.warning(f"[get_members] Search pass \"{query}\" failed after {Config.max_attempts} attempts")
+
+    async def _add(self, user):
+        self.scraper.entities.prime([user])
+        user_data = member_to_record(user)
+        if user.photo and not Config.stop_event.is_set():
+            await self.queue.put((user, user_data))
+        else:
+            await self._emit(user_data)
+
+    async def _emit(self, user_data: Participant):
+        metrics.inc("participants")
+        self.progress.update()
+        await self.scraper._emit("participants", user_data)
+        self.ready.append(user_data)
+
+    async def _worker(self, n: int):
+        while True:
+            user, user_data = await self.queue.get()
+            try:
+                path = os.path.join(self.scraper.participants_avatars_folder, f"{user.id}_{user.first_name}.jpg")
+                user_data.avatar = await self.scraper._download_avatar(user, user.id, path, "get_members")
+            except Exception as e:
+                logging.warning(f"[worker {n}] Failed to download avatar of user {user.id}: {e}")
+            finally:
+                await self._emit(user_data)
+                self.queue.task_done()
@@ -0,0 +1,156 @@
+import asyncio
+import functools
+import inspect
+import json
+import os
+import time
+from bot.settings import Config, logging
+
+
+class StageTimer:
+    """Context manager (sync and async) which records duration of a stage.\n
+    **Usage:**
+        async with metrics.timer("db_flush"): ...
+        with metrics.timer("json_write"): ...
+    """
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        self.__exit__(*exc)
+
+
+class Metrics:
+    """Per-stage timers and counters of scraping run.\n
+    Snapshot contains stage timers, counters (messages, comments, media bytes...), RPC counts and
+    FloodWait seconds of rate limiter. It can be exported periodically as JSON and Prometheus text format.\n
+    **Usage:**
+        metrics.inc("messages")
+        @metrics.timed("fetch_messages")
+        async def fetch_messages(): ...
+    """
+    def __init__(self):
+        self.started_at = time.time()
+        self.counters = {}
+        self.timers = {}
+        self._exporter = None
+
+    def reset(self):
+        """Drop all recorded metrics (e.g. between benchmark runs)"""
+        self.started_at = time.time()
+        self.counters.clear()
+        self.timers.clear()
+
+    def inc(self, name: str, value: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        timer = self.timers.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        timer["count"] += 1
+        timer["total"] += seconds
+        timer["max"] = max(timer["max"], seconds)
+
+    def timer(self, name: str) -> StageTimer:
+        return StageTimer(self, name)
+
+    def timed(self, name: str = None):
+        """Decorator which records duration of sync or async function"""
+        def decorator(func):
+            stage = name or func.__name__
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(stage):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> dict:
+        from .ratelimit import limiter_stats
+
+        elapsed = time.time() - self.started_at
+        rpc = limiter_stats()
+        return {
+            "timestamp": time.time(),
+            "elapsed": elapsed,
+            "counters": dict(self.counters),
+            "stages": {name: dict(timer) for name, timer in self.timers.items()},
+            "media_bytes_per_second": self.counters.get("media_bytes", 0) / elapsed if elapsed else 0,
+            "messages_per_second": self.counters.get("messages", 0) / elapsed if elapsed else 0,
+            "rpc": rpc,
+            "rpc_calls": sum(counters["calls"] for counters in rpc.values()),
+            "flood_wait_seconds": sum(counters["flood_wait_seconds"] for counters in rpc.values()),
+        }
+
+    def to_prometheus(self) -> str:
+        """Snapshot in Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE scraper_elapsed_seconds gauge",
+            f"scraper_elapsed_seconds {snapshot['elapsed']}",
+        ]
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE scraper_{name}_total counter")
+            lines.append(f"scraper_{name}_total {value}")
+        lines.append("# TYPE scraper_stage_seconds summary")
+        for name, timer in sorted(snapshot["stages"].items()):
+            lines.append(f'scraper_stage_seconds_sum{{stage="{name}"}} {timer["total"]}')
+            lines.append(f'scraper_stage_seconds_count{{stage="{name}"}} {timer["count"]}')
+        for metric in ("calls", "retries", "failures", "flood_waits", "flood_wait_seconds", "waited"):
+            lines.append(f"# TYPE scraper_rpc_{metric}_total counter")
+            for rpc_class, counters in sorted(snapshot["rpc"].items()):
+                lines.append(f'scraper_rpc_{metric}_total{{rpc_class="{rpc_class}"}} {counters[metric]}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, folder: str = None):
+        """Write metrics.json and metrics.prom to folder (Config.metrics_folder by default)"""
+        folder = folder or Config.metrics_folder
+        os.makedirs(folder, exist_ok=True)
+        for filename, content in (("metrics.json", json.dumps(self.snapshot(), indent=4)),
+                                  ("metrics.prom", self.to_prometheus())):
+            tmp_path = os.path.join(folder, filename + ".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, os.path.join(folder, filename))
+
+    async def _run_exporter(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.export()
+            except OSError as e:
+                logging.warning(f"[Metrics] Failed to export metrics: {e}")
+
+    def start_exporter(self, interval: float = None):
+        """Export metrics every Config.metrics_interval seconds in background"""
+        if self._exporter is None:
+            self._exporter = asyncio.create_task(self._run_exporter(interval or Config.metrics_interval))
+
+    async def stop_exporter(self):
+        """Stop background exporter and write final snapshot"""
+        if self._exporter is not None:
+            self._exporter.cancel()
+            await asyncio.gather(self._exporter, return_exceptions=True)
+            self._exporter = None
+        self.export()
+
+
+metrics = Metrics()
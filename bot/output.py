@@ -0,0 +1,273 @@
+import gzip
+import heapq
+import io
+import os
+import tempfile
+import time
+import zlib
+from bot.settings import Config, logging
+from .metrics import metrics
+from .serializers import get_serializer
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+# Raised when compressed file ends in the middle of a member/frame, e.g. after crash
+TRUNCATED_ERRORS = (EOFError, zlib.error, gzip.BadGzipFile) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+def _open_text(path: str, mode: str, compression: str = None):
+    """Open text file with optional gzip/zstd compression.\n
+    **Is not meant to be called directly!**"""
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if compression == "zstd":
+        if mode == "r":
+            raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+        else:
+            raw = zstandard.ZstdCompressor().stream_writer(open(path, mode + "b"), closefd=True)
+        return io.TextIOWrapper(raw, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class JsonlWriter:
+    """Appends records to JSONL file, one record per line.\n
+    File is flushed every Config.output_flush_every records or Config.output_flush_interval seconds,
+    so partial runs are still readable.\n
+    **Usage:**
+        writer = JsonlWriter("durov/jsons/messages.jsonl", compression="gzip")
+        writer.write({"id": 1})
+        writer.close()
+    """
+    def __init__(self, path: str, compression: str = None, flush_every: int = None, flush_interval: float = None):
+        if compression == "zstd" and zstandard is None:
+            logging.warning("zstandard is not installed, falling back to gzip compression")
+            compression = "gzip"
+        self.compression = compression
+        self.path = path + EXTENSIONS[compression]
+        self.flush_every = flush_every or Config.output_flush_every
+        self.flush_interval = flush_interval or Config.output_flush_interval
+        self.count = 0
+        self.serializer = get_serializer()
+        self._file = None
+        self._pending = 0
+        self._flushed_at = time.monotonic()
+
+    def write(self, record: dict):
+        """Write one record, file is opened on first write"""
+        if self._file is None:
+            self._file = _open_text(self.path, "a", self.compression)
+        self._file.write(self.serializer.dumps(record) + "\n")
+        self.count += 1
+        self._pending += 1
+        if self._pending >= self.flush_every or time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._file is not None and self._pending:
+            with metrics.timer("jsonl_flush"):
+                self._file.flush()
+            self._pending = 0
+            self._flushed_at = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._pending = 0
+
+
+def read_jsonl(path: str):
+    """Read records from JSONL file (compressed files are detected by extension).\n
+    Broken last line (e.g. after crash) is skipped. Compressed file is read up to its first truncated
+    member/frame, records appended after it (by the next runs) can't be recovered.
+    :returns: generator with records
+    """
+    compression = "gzip" if path.endswith(".gz") else "zstd" if path.endswith(".zst") else None
+    loads = get_serializer().loads
+    with _open_text(path, "r", compression) as f:
+        try:
+            for line in f:
+                try:
+                    yield loads(line)
+                except ValueError:
+                    logging.warning(f"[read_jsonl] Skipped broken line in {path}")
+        except TRUNCATED_ERRORS as e:
+            logging.warning(f"[read_jsonl] {path} is truncated, the rest of it is skipped: {e!r}")
+
+
+class OutputStream:
+    """Streaming output of Scraper, one JSONL file per record kind in jsons folder.\n
+    Records are appended as soon as they are produced, finalize() can still build the old
+    whole-document layout (messages.json) from them.\n
+    **Usage:**
+        output = OutputStream(bot.jsons_folder)
+        output.write("messages", msg_data)
+        output.close()
+        output.finalize(target_info)
+    """
+    def __init__(self, folder: str, compression: str = None):
+        self.folder = folder
+        self.compression = compression if compression is not None else Config.output_compression
+        self._writers = {}
+
+    def writer(self, kind: str) -> JsonlWriter:
+        if kind not in self._writers:
+            self._writers[kind] = JsonlWriter(os.path.join(self.folder, f"{kind}.jsonl"), self.compression)
+        return self._writers[kind]
+
+    def path(self, kind: str) -> str:
+        return self.writer(kind).path
+
+    def write(self, kind: str, record: dict):
+        self.writer(kind).write(record)
+
+    def flush(self):
+        for writer in self._writers.values():
+            writer.flush()
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+
+    def reset(self, kind: str):
+        """Remove records of given kind written by previous runs"""
+        writer = self.writer(kind)
+        writer.close()
+        if os.path.exists(writer.path):
+            os.remove(writer.path)
+
+    def read(self, kind: str):
+        """Read all records of given kind written so far (by this and previous runs)"""
+        path = self.path(kind)
+        if not os.path.exists(path):
+            return
+        yield from read_jsonl(path)
+
+    def finalize(self, target_info: dict, filename: str = "messages") -> int:
+        """Build messages.json with the same layout as Scraper.fetch_messages() result.\n
+        Messages are deduplicated by id (last written wins) and sorted from newest to oldest,
+        comments are attached to their posts. Records are sorted in chunks of Config.finalize_chunk_size
+        and merged from temporary files, so memory use doesn't grow with number of runs.
+        :param target_info: dict with target info
+        :param filename: name of JSON file without extension
+        :returns: number of messages written
+        """
+        self.flush()
+        with metrics.timer("json_write"), tempfile.TemporaryDirectory(dir=self.folder) as tmp:
+            count = self._write_document(filename, "messages", target_info, self._merged_messages(tmp),
+                                         pretty=Config.pretty_json)
+        logging.info(f"Finalized {count} messages to {filename}.json")
+        return count
+
+    def finalize_list(self, kind: str, target_info, filename: str = None) -> int:
+        """Write {"target": target_info, kind: [records]} JSON file, records are streamed from kind.jsonl
+        one by one, so they are never loaded into memory all at once.
+        :param kind: record kind, also the key of the list
+        :param target_info: value of "target" key
+        :param filename: name of JSON file without extension (kind by default)
+        """
+        self.writer(kind).close()
+        with metrics.timer("json_write"):
+            count = self._write_document(filename or kind, kind, target_info, self.read(kind))
+        logging.info(f"Finalized {count} {kind} to {filename or kind}.json")
+        return count
+
+    def finalize_by_id(self, kind: str, filename: str = None) -> int:
+        """Write JSON list of all records of given kind written by this and previous runs, deduplicated by id
+        (last written wins) and sorted from newest to oldest, e.g. admin log fetched incrementally.
+        :param kind: record kind
+        :param filename: name of JSON file without extension (kind by default)
+        :returns: number of records written
+        """
+        self.writer(kind).close()
+        dumps = get_serializer(pretty=Config.pretty_json).dumps
+        count = 0
+        with metrics.timer("json_write"), tempfile.TemporaryDirectory(dir=self.folder) as tmp, \
+                open(os.path.join(self.folder, f"{filename or kind}.json"), 'w', encoding='utf-8') as f:
+            f.write("[")
+            for record in self._newest_first(kind, tmp):
+                f.write(("," if count else "") + "\n    " + dumps(record).replace("\n", "\n    "))
+                count += 1
+            f.write("\n]\n" if count else "]\n")
+        logging.info(f"Finalized {count} {kind} to {filename or kind}.json")
+        return count
+
+    def _write_document(self, filename: str, kind: str, target_info, records, pretty: bool = False) -> int:
+        """Write {"target": ..., kind: [...]} record by record, pretty layout is the same as dump() of whole document"""
+        dumps = get_serializer(pretty=pretty).dumps
+        count = 0
+        with open(os.path.join(self.folder, f"{filename}.json"), 'w', encoding='utf-8') as f:
+            f.write('{\n    "target": ' + dumps(target_info).replace("\n", "\n    ") + f',\n    "{kind}": [')
+            for record in records:
+                f.write(("," if count else "") + "\n        " + dumps(record).replace("\n", "\n        "))
+                count += 1
+            f.write("\n    ]\n}\n" if count else "]\n}\n")
+        return count
+
+    def _sorted(self, kind: str, key, tmp: str):
+        """(seq, record) pairs of given kind sorted by key(seq, record), seq is the order records were written in.\n
+        Chunks of Config.finalize_chunk_size records are sorted in memory and written to tmp folder,
+        then merged lazily.
+        """
+        serializer = get_serializer()
+        runs, chunk = [], []
+
+        def spill():
+            chunk.sort(key=lambda item: key(*item))
+            path = os.path.join(tmp, f"{kind}.{len(runs)}.jsonl")
+            with open(path, 'w', encoding='utf-8') as f:
+                for item in chunk:
+                    f.write(serializer.dumps(item) + "\n")
+            runs.append(path)
+            chunk.clear()
+
+        for item in enumerate(self.read(kind)):
+            chunk.append(item)
+            if len(chunk) >= Config.finalize_chunk_size:
+                spill()
+        if not runs:
+            chunk.sort(key=lambda item: key(*item))
+            yield from chunk
+            return
+        if chunk:
+            spill()
+
+        def read_run(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    yield tuple(serializer.loads(line))
+
+        yield from heapq.merge(*[read_run(path) for path in runs], key=lambda item: key(*item))
+
+    def _newest_first(self, kind: str, tmp: str):
+        """Records of given kind newest first, deduplicated by id (last written wins)"""
+        last_id = None
+        for _, record in self._sorted(kind, lambda seq, record: (-record["id"], -seq), tmp):
+            if record["id"] != last_id:
+                last_id = record["id"]
+                yield record
+
+    def _merged_messages(self, tmp: str):
+        """Messages newest first, deduplicated by id, with comments attached"""
+        messages = self._newest_first("messages", tmp)
+        comments = self._sorted("comments", lambda seq, comment: (-comment["post_id"], comment["id"], -seq), tmp)
+        pending = next(comments, None)
+        for message in messages:
+            last_id = message["id"]
+            while pending is not None and pending[1]["post_id"] > last_id:
+                pending = next(comments, None)
+            thread = []
+            while pending is not None and pending[1]["post_id"] == last_id:
+                comment = pending[1]
+                if not thread or thread[-1]["id"] != comment["id"]:
+                    comment.pop("post_id")
+                    thread.append(comment)
+                pending = next(comments, None)
+            if thread:
+                message["comments"] = thread
+            yield message
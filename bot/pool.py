@@ -0,0 +1,121 @@
+import time
+from contextlib import asynccontextmanager
+from bot.settings import Config, logging, _LazyClient
+from .ratelimit import get_limiter, session_limiter, bind_limiter, unbind_limiter
+
+
+class Session:
+    """One account of ClientPool: its client, rate limiter (token buckets, FloodWait pauses,
+    request slots) and health counters.\n
+    **Usage:** session = Session("account1", TelegramClient("account1", api_id, api_hash))
+    """
+    def __init__(self, name: str, client, limiter=None):
+        self.name = name
+        self.client = client
+        self.limiter = limiter or session_limiter()
+        self.active = 0  # targets scraped with this session right now
+        self.targets = 0  # targets assigned since start
+        self.failures = 0  # targets which failed with this session
+        self.healthy = True  # False when session couldn't be started
+
+    def flood_wait(self) -> float:
+        """Seconds until the longest FloodWait pause of this session ends"""
+        now = time.monotonic()
+        return max([bucket.paused_until - now for bucket in self.limiter.buckets.values()] + [0])
+
+    def stats(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "active": self.active,
+            "targets": self.targets,
+            "failures": self.failures,
+            "flood_wait": round(self.flood_wait(), 1),
+            "rpc": self.limiter.stats(),
+        }
+
+
+class ClientPool:
+    """Pool of telegram sessions (accounts), each target is scraped with one of them.\n
+    Every session has its own rate limiter, so total request budget grows with number of sessions.
+    A target gets the healthy session which isn't paused by FloodWait (or is paused for the shortest time)
+    and scrapes the fewest targets at the moment. Entities and messages can't be shared by accounts,
+    so one target stays on its session, FloodWait of a session only routes the next targets around it.
+    With less than two sessions configured the pool holds only Config.client and the shared rate limiter,
+    which is exactly how single account scraping works.\n
+    **Usage:**
+        pool = ClientPool.from_config()
+        await pool.start()
+        async with pool.session() as session:
+            bot = Scraper("durov", client=session.client)
+    """
+    def __init__(self, sessions: list[Session]):
+        if not sessions:
+            raise ValueError("ClientPool needs at least one session")
+        self.sessions = sessions
+
+    @classmethod
+    def from_config(cls) -> "ClientPool":
+        """Pool of Config.sessions (session file names), or Config.client alone when less than two are listed
+        (built from the only listed session, if any)"""
+        if len(Config.sessions) < 2:
+            name = Config.sessions[0] if Config.sessions else "default"
+            if Config.sessions and Config.session_name != name:
+                if isinstance(vars(Config)["client"], _LazyClient):
+                    Config.session_name = name
+                else:
+                    logging.warning(f"[ClientPool] Config.client is already built, session {name} isn't used")
+            return cls([Session(name, Config.client, limiter=get_limiter())])
+
+        from telethon import TelegramClient
+
+        if not Config.API_ID or not Config.API_HASH:
+            raise RuntimeError("API_ID and API_HASH have to be set in .env file")
+        return cls([Session(name, TelegramClient(name, api_id=int(Config.API_ID), api_hash=Config.API_HASH))
+                    for name in Config.sessions])
+
+    def __len__(self):
+        return len(self.sessions)
+
+    async def start(self):
+        """Start (log in) all sessions, sessions which fail to start are left out"""
+        for session in self.sessions:
+            try:
+                await session.client.start()
+            except Exception as e:
+                if len(self.sessions) == 1:
+                    raise
+                session.healthy = False
+                logging.warning(f"[ClientPool] Session {session.name} couldn't be started: {e}")
+        if not any(session.healthy for session in self.sessions):
+            raise RuntimeError("None of sessions could be started")
+        logging.info(f"[ClientPool] Started {sum(session.healthy for session in self.sessions)} sessions")
+
+    async def disconnect(self):
+        for session in self.sessions:
+            await session.client.disconnect()
+
+    def pick(self) -> Session:
+        """Healthy session with the shortest FloodWait pause and the fewest active targets"""
+        healthy = [session for session in self.sessions if session.healthy] or self.sessions
+        return min(healthy, key=lambda session: (session.flood_wait() > 0, session.flood_wait(),
+                                                 session.active, session.targets))
+
+    @asynccontextmanager
+    async def session(self):
+        """Assign session to the current task: its rate limiter is used by every call made inside
+        (tasks started inside inherit it), failures are counted in session health"""
+        session = self.pick()
+        session.active += 1
+        session.targets += 1
+        token = bind_limiter(session.limiter)
+        try:
+            yield session
+        except Exception:
+            session.failures += 1
+            raise
+        finally:
+            unbind_limiter(token)
+            session.active -= 1
+
+    def stats(self) -> dict:
+        return {session.name: session.stats() for session in self.sessions}
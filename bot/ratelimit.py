@@ -0,0 +1,185 @@
+import asyncio
+import random
+import time
+from contextvars import ContextVar
+from telethon.errors import FloodWaitError
+from bot.settings import Config, logging
+
+
+class TokenBucket:
+    """Token bucket for one RPC class.\n
+    Waiting callers are served in order of arrival, pause() stops the whole class
+    (e.g. after FloodWait) for every task using it.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """Wait for a token.
+        :returns: seconds spent waiting
+        """
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    delay = (1 - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class RateLimiter:
+    """Shared request governance for all Telethon calls, one token bucket per RPC class.\n
+    RPC classes and their rates are configured with Config.rpc_rates, unknown classes use "default".
+    Each limiter has its own Config.max_concurrent_requests request slots.\n
+    **Usage:**
+        await get_limiter().acquire("get_entity")
+        get_limiter().pause("get_entity", e.seconds)
+    """
+    def __init__(self, rates: dict):
+        self.rates = rates
+        self.buckets = {}
+        self.counters = {}
+        self._slots = None
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        """Semaphore limiting number of requests in flight, created on first use (inside event loop)"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(Config.max_concurrent_requests)
+        return self._slots
+
+    def bucket(self, rpc_class: str) -> TokenBucket:
+        if rpc_class not in self.rates:
+            rpc_class = "default"
+        if rpc_class not in self.buckets:
+            rate, burst = self.rates[rpc_class]
+            self.buckets[rpc_class] = TokenBucket(rate, burst)
+        return self.buckets[rpc_class]
+
+    def count(self, rpc_class: str, name: str, value: float = 1):
+        counters = self.counters.setdefault(rpc_class, {"calls": 0, "waited": 0.0, "flood_waits": 0,
+                                                        "flood_wait_seconds": 0, "retries": 0, "failures": 0})
+        counters[name] += value
+
+    async def acquire(self, rpc_class: str):
+        waited = await self.bucket(rpc_class).acquire()
+        self.count(rpc_class, "calls")
+        if waited:
+            self.count(rpc_class, "waited", waited)
+
+    def pause(self, rpc_class: str, seconds: float):
+        """Pause RPC class for all tasks, used to honor FloodWait"""
+        self.bucket(rpc_class).pause(seconds)
+        self.count(rpc_class, "flood_waits")
+        self.count(rpc_class, "flood_wait_seconds", seconds)
+
+    def stats(self) -> dict:
+        """Counters of calls, waits, FloodWaits and retries per RPC class"""
+        return {rpc_class: dict(counters) for rpc_class, counters in self.counters.items()}
+
+
+_limiter = None
+_session_limiters = []  # limiters of ClientPool sessions
+_current = ContextVar("rate_limiter", default=None)  # limiter of session bound to current task
+
+
+def get_limiter() -> RateLimiter:
+    """Rate limiter of ClientPool session bound to current task (see bind_limiter),
+    otherwise the one shared by all Scraper instances"""
+    global _limiter
+    limiter = _current.get()
+    if limiter is not None:
+        return limiter
+    if _limiter is None:
+        _limiter = RateLimiter(Config.rpc_rates)
+    return _limiter
+
+
+def session_limiter() -> RateLimiter:
+    """New rate limiter for one ClientPool session, its stats are included in limiter_stats()"""
+    limiter = RateLimiter(Config.rpc_rates)
+    _session_limiters.append(limiter)
+    return limiter
+
+
+def bind_limiter(limiter: RateLimiter):
+    """Use limiter in current task and tasks started from it, returns token for unbind_limiter()"""
+    return _current.set(limiter)
+
+
+def unbind_limiter(token):
+    _current.reset(token)
+
+
+def limiter_stats() -> dict:
+    """Counters of shared limiter and all session limiters, summed per RPC class"""
+    limiters = ([_limiter] if _limiter is not None else []) + _session_limiters
+    res = {}
+    for limiter in limiters:
+        for rpc_class, counters in limiter.stats().items():
+            total = res.setdefault(rpc_class, dict.fromkeys(counters, 0))
+            for name, value in counters.items():
+                total[name] += value
+    return res
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter: random delay up to base * 2^(attempt - 1), capped by Config.backoff_max"""
+    return random.uniform(0, min(Config.backoff_max, Config.backoff_base * 2 ** (attempt - 1)))
+
+
+async def limited(iterator, rpc_class: str, page_size: int = 100, resume=None):
+    """Take a token from rate limiter before each page request of async iterator (e.g. client.iter_messages()),
+    so pages wait for the rate and FloodWait pauses of their RPC class.\n
+    FloodWait pauses the RPC class for all tasks. If `resume` is given, iteration continues after the pause
+    with iterator returned by resume(last_item) (last_item is None if nothing was yielded yet),
+    otherwise (or if the wait is longer than Config.max_flood_wait) FloodWaitError is raised.\n
+    **Usage:**
+        async for message in limited(client.iter_messages("durov"), "get_messages",
+                                     resume=lambda last: client.iter_messages("durov", offset_id=last.id if last else 0)):
+    """
+    limiter = get_limiter()
+    iterator = aiter(iterator)
+    count, total, last = 0, 0, None
+    while True:
+        # Telethon iterators request the next page when buffered items of previous one are used up
+        if count % page_size == 0:
+            await limiter.acquire(rpc_class)
+        try:
+            item = await anext(iterator)
+        except StopAsyncIteration:
+            break
+        except FloodWaitError as e:
+            limiter.pause(rpc_class, e.seconds)
+            if resume is None or e.seconds > Config.max_flood_wait:
+                limiter.count(rpc_class, "failures")
+                raise
+            print(f"[FloodWait] - [{rpc_class}] Too many requests sent! Waiting for {e.seconds} seconds...")
+            iterator = aiter(resume(last))
+            count = 0
+            continue
+        count += 1
+        total += 1
+        last = item
+        yield item
+    logging.debug("[limited] %s: iterated %d items", rpc_class, total)
@@ -0,0 +1,125 @@
+class Record:
+    """Base of compact scraped records, fields are kept in __slots__ instead of per-instance dict.\n
+    Records can be read and updated like dicts (record['media'] = path), so stages and sinks which
+    work with dicts don't have to care. to_dict() builds plain dict (nested records included) for sinks
+    and serializers.\n
+    **Usage:**
+        class Geo(Record):
+            __slots__ = ("latitude", "longitude")
+        geo = Geo(latitude=50.45, longitude=30.52)
+    """
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELDS = tuple(field for klass in reversed(cls.__mro__) for field in klass.__dict__.get("__slots__", ()))
+
+    def __init__(self, **kwargs):
+        for field in self.FIELDS:
+            setattr(self, field, kwargs.pop(field, None))
+        if kwargs:
+            raise TypeError(f"{type(self).__name__} has no fields {', '.join(kwargs)}")
+
+    def __getitem__(self, key: str):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.FIELDS
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default) if key in self.FIELDS else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def to_dict(self, exclude: tuple = ()) -> dict:
+        """Plain dict with all fields (except excluded ones), nested records are converted too"""
+        return {field: _plain(getattr(self, field)) for field in self.FIELDS if field not in exclude}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.FIELDS)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{field}={getattr(self, field)!r}' for field in self.FIELDS)})"
+
+
+def _plain(value):
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+
+class UserRef(Record):
+    """User referenced by another record (admin log performer)"""
+    __slots__ = ("user_id", "first_name", "last_name", "username")
+
+
+class Sender(UserRef):
+    """Message sender, interned by SenderPool, so all messages of one user share the same instance"""
+    __slots__ = ("avatar", "is_bot")
+
+
+class Participant(UserRef):
+    __slots__ = ("avatar",)
+
+
+class Geo(Record):
+    __slots__ = ("latitude", "longitude")
+
+
+class Comment(Record):
+    __slots__ = ("id", "text", "date", "changed_at", "user_id", "post_id")
+
+
+class Message(Record):
+    """Scraped message, 'media' and 'comments' are filled in by their stages"""
+    __slots__ = ("id", "text", "date", "changed_at", "sender", "media", "geo", "comments")
+
+
+class PinnedMessage(Record):
+    __slots__ = ("id", "text", "from_id", "date", "changed_at")
+
+
+class AdminLogEntry(Record):
+    """Admin log event: action is short action name (e.g. "delete_message"), details are its fields"""
+    __slots__ = ("id", "action", "details", "performed_by", "timestamp", "error")
+
+
+class MessageDelta(Record):
+    """Change of already scraped message found by Verifier: changes is a list of "edited", "deleted",
+    "replies" and "reactions", text is set only for edited messages"""
+    __slots__ = ("id", "changes", "text", "changed_at", "replies", "reactions", "detected_at")
+
+
+NO_SENDER = Sender()  # messages without sender (e.g. channel posts)
+
+
+class SenderPool:
+    """Interned senders of one Scraper run, keyed by user id.\n
+    **Usage:**
+        sender = pool.get(user_id)
+        if sender is None: sender = pool.add(Sender(user_id=user_id, ...))
+    """
+    def __init__(self):
+        self._senders = {}
+
+    def get(self, user_id: int) -> Sender | None:
+        return self._senders.get(user_id)
+
+    def add(self, sender: Sender) -> Sender:
+        return self._senders.setdefault(sender.user_id, sender)
+
+    def __len__(self):
+        return len(self._senders)
@@ -0,0 +1,200 @@
+import asyncio
+import os
+from datetime import datetime
+from bot.settings import Config, STAGES, logging
+from .scraper import Scraper
+from .filters import MessageFilter
+from .pool import ClientPool
+from .metrics import metrics
+from .utils import dump_json
+
+
+def _stage_factories(bot: Scraper, limit, offset, min_id, filters: MessageFilter = None) -> dict:
+    """Coroutine factory of each stage, keyed by the name of its output file"""
+    # Unfinished backfill is resumed even by incremental runs, filtered runs never use backfill
+    if Config.backfill and not filters and (bot.checkpoint.shards or not (min_id or offset)):
+        messages = lambda: bot.backfill_messages(collect=not Config.stream_output)
+    else:
+        messages = lambda: bot.fetch_messages(limit=limit, offset=offset, min_id=min_id, collect=not Config.stream_output,
+                                              filters=filters)
+        if min_id and not filters:
+            fetch_new = messages
+            messages = lambda: _incremental_messages(bot, fetch_new, min_id)
+    return {
+        "messages": messages,
+        "participants": lambda: bot.get_members(collect=not Config.stream_output),
+        "pinned_messages": bot.get_pinned_messages,
+        "target_info": bot.fetch_target_info,
+        "admin_logs": bot.get_admin_log,
+        "message_deltas": bot.verify_messages,
+    }
+
+
+async def _incremental_messages(bot: Scraper, fetch_new, min_id: int) -> dict:
+    """Messages stage of incremental run: messages newer than min_id, then new comments of the newest
+    Config.refresh_comments_posts posts scraped by earlier runs (older posts are never fetched again)"""
+    res = await fetch_new()
+    if Config.download_comments and Config.refresh_comments_posts and not Config.stop_event.is_set():
+        post_ids = sorted((int(post_id) for post_id in bot.checkpoint.comments if int(post_id) <= min_id),
+                          reverse=True)[:Config.refresh_comments_posts]
+        if post_ids:
+            await bot.refresh_comments(post_ids)
+    return res
+
+
+def _write_stage(bot: Scraper, name: str, data):
+    """Write output of finished stage to jsons folder"""
+    if name == "messages" and Config.stream_output:
+        # Messages are already written to messages.jsonl, build messages.json from it
+        bot.output.close()
+        if Config.finalize_json:
+            bot.output.finalize(data["target"])
+        return
+    if name == "participants" and Config.stream_output and data is not None:
+        # Members are already written to participants.jsonl, stream them to participants.json
+        if Config.finalize_json:
+            bot.output.finalize_list("participants", data["target"])
+        return
+    if name == "admin_logs" and Config.stream_output:
+        # Admin log is fetched incrementally, admin_logs.json is built from events of all runs
+        if Config.finalize_json:
+            bot.output.finalize_by_id("admin_logs")
+        return
+    dump_json(data, os.path.join(bot.jsons_folder, name))
+
+
+async def _run_stage(bot: Scraper, name: str, factory):
+    data = await factory()
+    _write_stage(bot, name, data)
+    logging.info(f"[{bot.target}] Stage {name} finished")
+    return data
+
+
+async def scrape_target(bot: Scraper, limit=100, offset=0, min_id=0, stages=None, filters: MessageFilter = None) -> dict:
+    """Run scrape of initialized Scraper and write results to its jsons folder.\n
+    Stages don't depend on each other, so they run concurrently (sharing the rate limiter of Config.client).
+    Output of each stage is written as soon as it's finished, failed stage doesn't affect the others.\n
+    **Usage:** await scrape_target(bot, limit=None, min_id=bot.checkpoint.max_id, stages=["messages", "admin_logs"])
+    :param stages: names of stages to run (see STAGES), Config.scrape_stages by default
+    :param filters: MessageFilter of messages stage
+    :returns: dict with results of finished stages (messages and participants are omitted when Config.stream_output
+        is turned on),
+        failed stages are listed in "errors"
+    """
+    stages = [name for name in STAGES if name in (stages if stages is not None else Config.scrape_stages)]
+    logging.debug(f"[{bot.target}] Passed limit: {limit}, offset: {offset}, min_id: {min_id}, stages: {stages}")
+    factories = _stage_factories(bot, limit, offset, min_id, filters)
+    results = await asyncio.gather(*(_run_stage(bot, name, factories[name]) for name in stages),
+                                   return_exceptions=True)
+
+    data_dict, errors = {}, {}
+    for name, result in zip(stages, results):
+        if isinstance(result, Exception):
+            logging.error(f"[{bot.target}] Stage {name} failed: {result}")
+            metrics.inc("failed_stages")
+            errors[name] = str(result)
+        elif not (name in ("messages", "participants") and Config.stream_output):
+            data_dict[name] = result
+    if errors:
+        data_dict["errors"] = errors
+
+    await bot.close_sinks()
+    return data_dict
+
+
+def load_targets(path: str) -> list[tuple[str, int]]:
+    """Read targets file, one target per line: "username [priority]".\n
+    Empty lines and lines starting with # are skipped, default priority is 0.
+    :returns: list of (target, priority) tuples
+    """
+    targets = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split()
+            targets.append((parts[0], int(parts[1]) if len(parts) > 1 else 0))
+    return targets
+
+
+class Scheduler:
+    """Scrape many targets concurrently on sessions of ClientPool (just Config.client by default).\n
+    Targets with higher priority are started first, at most `concurrency` targets run at the same time.
+    Each target is scraped with the least busy session which isn't paused by FloodWait.
+    Targets of one session share its Config.max_concurrent_requests request slots, which are handed out
+    in order of arrival, so each running target gets a fair share of them.
+    Progress of each target is written to <target>/jsons/status.json.\n
+    **Usage:**
+        scheduler = Scheduler([("durov", 1), ("telegram", 0)], concurrency=4, only_new=True)
+        results = await scheduler.run()
+    """
+    def __init__(self, targets: list[tuple[str, int]], concurrency: int = None, limit=None, only_new: bool = True,
+                 stages=None, filters: MessageFilter = None, pool: ClientPool = None):
+        self.targets = targets
+        self.concurrency = concurrency or Config.scheduler_concurrency
+        self.limit = limit
+        self.only_new = only_new
+        self.stages = stages
+        self.filters = filters
+        self.pool = pool
+        self.results = {}
+
+    async def run(self) -> dict:
+        """Scrape all targets.
+        :returns: dict {target: "done", "partial" (some stages failed) or exception}
+        """
+        if self.pool is None:
+            self.pool = ClientPool.from_config()
+        await self.pool.start()
+
+        queue = asyncio.PriorityQueue()
+        for index, (target, priority) in enumerate(self.targets):
+            queue.put_nowait((-priority, index, target))
+            self._write_status(target, "queued", priority=priority)
+
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(min(self.concurrency, len(self.targets)))]
+        await asyncio.gather(*workers)
+        logging.info(f"Scheduler finished {len(self.results)} targets, sessions: {self.pool.stats()}")
+        return self.results
+
+    async def _worker(self, queue: asyncio.PriorityQueue):
+        while not queue.empty():
+            priority, _, target = queue.get_nowait()
+            if Config.stop_event.is_set():
+                self._write_status(target, "skipped", priority=-priority)
+                continue
+            started_at = datetime.now().isoformat()
+            self._write_status(target, "running", priority=-priority, started_at=started_at)
+            try:
+                errors = await self._scrape(target)
+                self.results[target] = "partial" if errors else "done"
+                self._write_status(target, self.results[target], priority=-priority, started_at=started_at,
+                                   finished_at=datetime.now().isoformat(), **({"errors": errors} if errors else {}))
+            except Exception as e:
+                logging.error(f"[Scheduler] Failed to scrape {target}: {e}")
+                self.results[target] = e
+                self._write_status(target, "failed", priority=-priority, started_at=started_at,
+                                   finished_at=datetime.now().isoformat(), error=str(e))
+
+    async def _scrape(self, target: str) -> dict | None:
+        """Scrape one target, returns dict with errors of failed stages (if any)"""
+        async with self.pool.session() as session:
+            logging.info(f"[Scheduler] Scraping {target} with session {session.name}")
+            bot = Scraper(target, client=session.client)
+            try:
+                await bot.initialize()
+                # Filtered runs don't update checkpoint, so they always search the whole history
+                min_id = (bot.checkpoint.max_id or 0) if self.only_new and not self.filters else 0
+                limit = None if min_id else self.limit
+                data_dict = await scrape_target(bot, limit=limit, min_id=min_id, stages=self.stages, filters=self.filters)
+                return data_dict.get("errors")
+            finally:
+                await bot.close_sinks()
+
+    @staticmethod
+    def _write_status(target: str, status: str, **kwargs):
+        jsons_folder = Config.get_folders(target)["jsons_folder"]
+        os.makedirs(jsons_folder, exist_ok=True)
+        dump_json({"target": target, "status": status, "updated_at": datetime.now().isoformat(), **kwargs},
+                  os.path.join(jsons_folder, "status"))
@@ -1,27 +1,50 @@
+import inspect
 import os
+from collections import deque
 from datetime import datetime
 from telethon.errors import UserNotParticipantError
 from telethon.tl.functions.channels import GetFullChannelRequest
 from telethon.tl.types import Channel, Chat, MessageMediaPhoto, MessageMediaDocument, InputMessagesFilterPinned
 import mimetypes
 from bot.settings import Config
-from database.config import load_config
-from database.connect import connect
-from database.queries import *
 from .utils import safe_call
+from .ratelimit import limited
+from .metrics import metrics
+from .media import MediaDownloader
+from .media_store import MediaStore, get_media_store
+from .comments import CommentFetcher
+from .members import MemberExporter
+from .backfill import Backfill
+from .verify import MessageState, Verifier
+from .filters import MessageFilter
+from .admin_log import AdminLogExporter
+from .logs import Progress
+from .cache import EntityCache, CachedEntity
+from .target import TargetContext
+from .output import OutputStream
+from .checkpoint import Checkpoint
+from .records import Record, Message, Sender, Geo, PinnedMessage, SenderPool, NO_SENDER
 import time
 from bot.settings import logging
 
+
+async def _maybe_await(result):
+    """Sinks may be sync (OutputStream) or async (DB writers)"""
+    if inspect.isawaitable(result):
+        await result
+
+
 class Scraper:
     """Create instance of scraper class, and work with it"""
-    def __init__(self, target_channel: str):
+    def __init__(self, target_channel: str, client=None):
         """
         Init Scrapper class\n
         **Usage:** bot = Scrapper("durov")
         :param target_channel:
+        :param client: telegram client (e.g. session of ClientPool), Config.client by default
         """
         self.target = target_channel
-        self.client = Config.client
+        self.client = client or Config.client
 
         self.folders = Config.get_folders(self.target)
 
@@ -31,30 +54,88 @@ class Scraper:
         self.media_folder = self.folders['media_folder']
         self.jsons_folder = self.folders['jsons_folder']
 
+        self.entities = EntityCache(self.client)
+        self.entity_cache_path = os.path.join(self.target_folder, "entity_cache.json")
+
+        self.context = None
+        self._avatars = set()  # avatars saved during this run
+        self.senders = SenderPool()
+
+        self.output = OutputStream(self.jsons_folder) if Config.stream_output else None
+        self.sinks = [self.output] if self.output else []
+        self.checkpoint = Checkpoint.load(os.path.join(self.jsons_folder, "checkpoint.json"))
+        self.message_state = MessageState.load(os.path.join(self.jsons_folder, "message_state.json"))
+
         logging.info("Program initialized")
 
     async def connect(self):
-        """Connect to telegram client.\n
+        """Connect to telegram client, client shared with other Scraper instances is connected only once.\n
         **Is not meant to be called directly!**"""
-        await self.client.start()
+        if not self.client.is_connected():
+            await self.client.start()
         logging.info("Connected to telegram client")
 
     async def close(self):
         """Close connection to telegram client\n
         **Is not meant to be called directly!**"""
+        self.save_entity_cache()
+        await self.close_sinks()
         await self.client.disconnect()
         logging.info("Closing connection to telegram client")
 
     async def initialize(self):
-        """Initialize method, calls connect() and create_dirs()\n
+        """Initialize method, calls connect(), create_dirs() and resolve_target()\n
         **Is not meant to be called directly!**"""
         await self.connect()
         await self.create_dirs()
+        if Config.persist_entity_cache:
+            self.entities.load(self.entity_cache_path)
+        await self.resolve_target()
+        if Config.save_to_db and self.context:
+            from database.ingest import PostgresWriter
+            self.sinks.append(PostgresWriter(self.context.info, batch_size=Config.db_batch_size,
+                                             flush_interval=Config.db_flush_interval, queue_size=Config.db_queue_size,
+                                             on_flush=self._on_db_flush))
+        if Config.save_to_sqlite and self.context:
+            from database.sqlite import SQLiteWriter
+            self.sinks.append(SQLiteWriter(self.context.info, Config.sqlite_path, batch_size=Config.db_batch_size,
+                                           flush_interval=Config.db_flush_interval, queue_size=Config.db_queue_size,
+                                           on_flush=self._on_db_flush))
         logging.info("Instance initialized")
 
+    async def _emit(self, kind: str, record: dict | Record):
+        """Write record to all sinks (JSONL output stream, DB writer), records are passed as plain dicts.
+        DB writers wait for free space in their queue without blocking event loop.\n
+        **Is not meant to be called directly!**"""
+        if isinstance(record, Record):
+            record = record.to_dict()
+        for sink in self.sinks:
+            await _maybe_await(sink.write(kind, record))
+
+    @staticmethod
+    def _on_db_flush(kind: str, count: int, seconds: float):
+        metrics.observe("db_flush", seconds)
+        metrics.inc("db_records", count)
+
+    async def flush_sinks(self):
+        """Flush everything written so far to JSONL files and DB"""
+        for sink in self.sinks:
+            await _maybe_await(sink.flush())
+
+    async def close_sinks(self):
+        """Write remaining records and close all sinks"""
+        for sink in self.sinks:
+            await _maybe_await(sink.close())
+
+    def save_entity_cache(self):
+        """Save entity cache to target folder, if Config.persist_entity_cache is turned on"""
+        if Config.persist_entity_cache and os.path.isdir(self.target_folder):
+            self.entities.save(self.entity_cache_path)
+
+    @metrics.timed()
     async def get_pinned_messages(self):
         """Get all of pinned messages in the group.\n
-        Every 100 messages will call insert_pinned_messages to DB.\n
+        Pinned messages are written to all sinks (JSONL output, DB).\n
         **Usage:** await bot.get_pinned_messages()
         :returns: list with pinned messages
         """
@@ -64,88 +145,77 @@ class Scraper:
             logging.info("Interrupted by user")
             return None
 
-        pinned_messages = await safe_call(self.client.get_messages(self.target, filter=InputMessagesFilterPinned, limit=10), "get_pinned_messages")
-
-        target_info = await self.fetch_target_info()
-
-        config, conn = None, None
+        pinned_messages = await safe_call(lambda: self.client.get_messages(self.target, filter=InputMessagesFilterPinned, limit=10),
+                                          "get_pinned_messages", rpc_class="get_messages") or []
 
         res = []
 
         for msg in pinned_messages:
-            pinned_entry = {
-                'id': msg.id,
-                'text': msg.message,
-                'from_id': msg.from_id.user_id if msg.from_id else None,
-                'date': msg.date.isoformat(),
-                'changed_at': msg.edit_date.isoformat() if msg.edit_date and msg.edit_date != msg.date else None,
-            }
+            pinned_entry = PinnedMessage(
+                id=msg.id,
+                text=msg.message,
+                from_id=msg.from_id.user_id if msg.from_id else None,
+                date=msg.date.isoformat(),
+                changed_at=msg.edit_date.isoformat() if msg.edit_date and msg.edit_date != msg.date else None,
+            )
             res.append(pinned_entry)
-
-        if res and Config.save_to_db:
-            config = load_config()
-
-            conn = connect(config)
-            insert_pinned_messages(res, target_info["id"], conn)
+            await self._emit("pinned_messages", pinned_entry)
 
         logging.info("Finished fetching pinned messages")
 
         return res
 
+    @metrics.timed()
     async def get_admin_log(self):
-        """Get logs about admin actions.\n
+        """Get logs about admin actions newer than the last run (see AdminLogExporter).\n
         **Usage:** await bot.get_admin_log()
         :returns: list with logs
         """
-        logging.info("Started fetching admin logs")
-
         if Config.stop_event.is_set():
             logging.info("Interrupted by user")
             return None
+        return [log_entry async for log_entry in self.stream_admin_log()]
 
-        logs = []
+    async def stream_admin_log(self, events: list[str] = None):
+        """Async generator of admin log entries newer than the last run, newest first (see AdminLogExporter).\n
+        **Usage:** async for log_entry in bot.stream_admin_log(events=["ban"]): ...
+        :param events: event types to fetch (see ADMIN_LOG_EVENTS), Config.admin_log_events by default
+        """
+        logging.info("Started fetching admin logs")
 
         if await self.get_chat_type() in ["Channel admin"]:
-            async for action in self.client.iter_admin_log(self.target):
-                log_entry = {
-                    "action": str(action.action),
-                    "performed_by": {
-                        "user_id": action.user_id,
-                        "first_name": None,
-                        "last_name": None,
-                        "username": None
-                    },
-                    "timestamp": action.date.isoformat(),
-                }
-
-                try:
-                    user = await safe_call(self.client.get_entity(action.user_id), "get_admin_log")
-                    log_entry["performed_by"]["first_name"] = user.first_name
-                    log_entry["performed_by"]["username"] = user.username
-                except Exception as e:
-                    log_entry["performed_by"]["first_name"] = "Unknown"
-                    log_entry["performed_by"]["username"] = None
-                    log_entry["error"] = str(e)
-
-                logs.append(log_entry)
+            try:
+                async for log_entry in AdminLogExporter(self, events).stream():
+                    yield log_entry
+            finally:
+                self.save_entity_cache()
+                if os.path.isdir(self.jsons_folder):
+                    self.checkpoint.save()
         logging.info("Finished fetching admin logs")
-        return logs
 
-    async def fetch_target_info(self, full: bool = False) -> dict | None:
-        """
-        Fetch basic (fast) or full (slow) info about the target channel.
-        :param full: Set to True to fetch full participant and admin stats + avatar.
-        :returns: dict with target info
+    @metrics.timed()
+    async def resolve_target(self, refresh: bool = False) -> TargetContext | None:
+        """Resolve target entity, chat type, permissions and basic info.\n
+        Result is memoized for the lifetime of Scraper instance and used by every method afterwards.\n
+        **Usage:** await bot.resolve_target(refresh=True)
+        :param refresh: Set to True to resolve target again
+        :returns: TargetContext
         """
-        logging.info("Started fetching target info")
+        if self.context is not None and not refresh:
+            return self.context
+
+        logging.info("Started resolving target")
 
         if Config.stop_event.is_set():
             logging.info("Interrupted by user")
             return None
 
-        entity = await safe_call(self.client.get_entity(self.target), "fetch_target_info")
+        entity = await safe_call(lambda: self.client.get_entity(self.target), "resolve_target", rpc_class="get_entity")
+        self.entities.put(entity, key=self.target)
+
+        chat_type, permissions = await self._resolve_chat_type(entity)
 
-        res = {
+        info = {
             "id": entity.id,
             "username": self.target,
             "title": entity.title,
@@ -159,10 +229,29 @@ class Scraper:
             "requested_at": datetime.now().isoformat()
         }
 
+        self.context = TargetContext(entity, chat_type, permissions, info)
+        logging.info(f"Resolved target: {self.context}")
+        return self.context
+
+    async def fetch_target_info(self, full: bool = False) -> dict | None:
+        """
+        Fetch basic (fast) or full (slow) info about the target channel.\n
+        Basic info is taken from resolved target, so it doesn't make any requests after initialize().
+        :param full: Set to True to fetch full participant and admin stats + avatar.
+        :returns: dict with target info
+        """
+        logging.info("Started fetching target info")
+
+        context = await self.resolve_target()
+        if context is None:
+            return None
+
+        res = context.info
+
         if full:
             logging.info("Started fetching full target info (this may take some time)")
             start = time.time()
-            channel_info = await safe_call(self.client(GetFullChannelRequest(channel=self.target)), "fetch_target_info")
+            channel_info = await safe_call(lambda: self.client(GetFullChannelRequest(channel=context.entity)), "fetch_target_info")
             logging.info(f"Full channel info fetched in {time.time() - start:.2f} seconds")
 
             full_chat = channel_info.full_chat
@@ -177,15 +266,35 @@ class Scraper:
             avatar_path = os.path.join(self.avatar_folder, f"{self.target}_avatar.jpg")
             if full_chat.chat_photo:
                 try:
-                    profile_photos = await safe_call(self.client.get_profile_photos(self.target), "fetch_target_info")
+                    profile_photos = await safe_call(lambda: self.client.get_profile_photos(context.entity), "fetch_target_info")
                     if profile_photos:
-                        await safe_call(self.client.download_media(profile_photos[0], file=avatar_path), "fetch_target_info")
+                        await safe_call(lambda: self.client.download_media(profile_photos[0], file=avatar_path),
+                                        "fetch_target_info", rpc_class="download")
                         res["avatar"] = avatar_path if os.path.exists(avatar_path) else None
                 except Exception as e:
                     print(f"[ERROR] Failed to fetch avatar: {e}")
         logging.info("Finished fetching target info")
         return res
 
+    async def participants_count(self) -> int | None:
+        """Number of participants reported by telegram. Resolved entity of a channel usually doesn't have it,
+        so it's taken from full channel info (one request, kept in target info for the rest of the run)."""
+        context = await self.resolve_target()
+        if context is None:
+            return None
+        count = context.info.get("participants_count")
+        if isinstance(count, int):
+            return count
+        if isinstance(context.entity, Chat):
+            count = getattr(context.entity, "participants_count", None)
+        else:
+            channel_info = await safe_call(lambda: self.client(GetFullChannelRequest(channel=context.entity)),
+                                           "participants_count")
+            count = channel_info.full_chat.participants_count if channel_info else None
+        if count:
+            context.info["participants_count"] = count
+        return count
+
     async def create_dirs(self):
         """Generate dirs based on Config dirs.\n
         **Is not meant to be called directly!**"""
@@ -196,189 +305,379 @@ class Scraper:
 
     async def get_chat_type(self) -> str | None:
         """Get chat type, returns string with a type"""
-        logging.info("Started parsing chat type")
+        context = await self.resolve_target()
+        return context.chat_type if context else None
 
-        if Config.stop_event.is_set():
-            logging.info("Interrupted by user")
-            return None
-
-        entity = await safe_call(self.client.get_entity(self.target), "get_chat_type")
+    async def _resolve_chat_type(self, entity) -> tuple[str, object]:
+        """Parse chat type of entity, permissions are fetched for broadcast channels only.\n
+        **Is not meant to be called directly!**
+        :returns: tuple with chat type and permissions (or None)
+        """
+        logging.info("Started parsing chat type")
 
         if isinstance(entity, Channel):
             if entity.megagroup:
                 logging.info("Parsed chat type: Mega group")
-                return "Mega group"
+                return "Mega group", None
             else:
-                user = await self.client.get_me()
+                user = await safe_call(lambda: self.client.get_me(), "get_chat_type")
                 try:
-                    permissions = await self.client.get_permissions(self.target, user.id)
+                    permissions = await safe_call(lambda: self.client.get_permissions(entity, user.id), "get_chat_type",
+                                                  raise_on=UserNotParticipantError)
                 except UserNotParticipantError:
                     logging.warning(f"User is not participant!")
-                    return "User not participant"
+                    return "User not participant", None
                 if permissions.is_admin or permissions.is_creator:
                     logging.info("Parsed chat type: Creator/Admin")
-                    return "Channel admin"
+                    return "Channel admin", permissions
                 else:
                     logging.info("Parsed chat type: user (participant)")
-                    return "Channel user"
+                    return "Channel user", permissions
         elif isinstance(entity, Chat):
-            return "Chat group"
+            return "Chat group", None
         else:
-            return "Unknown"
+            return "Unknown", None
 
-    async def fetch_messages(self, limit=100, offset=0) -> dict:
-        """Fetch messages from group, will save everything to DB, and create JSON file.\n
-        **Usage:** await bot.fetch_messages()
-        :returns: dict with messages
+    async def _download_avatar(self, entity, entity_id: int, path: str, method_name: str) -> str | None:
+        """Download profile photo of entity to path, through shared media store (if turned on).\n
+        Avatars already saved during this run are not checked on disk again.\n
+        **Is not meant to be called directly!**
+        :returns: path to avatar or None if entity has no photo
         """
-        logging.info("Started fetching messages")
-        messages = []
+        if path in self._avatars:
+            return path
+        if not entity.photo:
+            return None
 
-        count = 0
-        comments = []
+        # Entities restored from disk cache can't be passed to telethon, so pass id instead
+        photo_entity = entity_id if isinstance(entity, CachedEntity) else entity
 
-        target_info = await self.fetch_target_info()
-        config, conn = None, None
+        async def download(file):
+            return await safe_call(lambda: self.client.download_profile_photo(photo_entity, file=file),
+                                   method_name, rpc_class="download")
 
-        if Config.save_to_db:
-            config = load_config()
+        store = get_media_store()
+        if os.path.exists(path):
+            saved_path = path
+        elif store is not None:
+            saved_path = await store.fetch(MediaStore.avatar_key(entity), path, download)
+        else:
+            saved_path = await download(path)
+
+        if saved_path and os.path.exists(saved_path):
+            self._avatars.add(path)
+            return path
+        return None
 
-            conn = connect(config)
-            insert_group_info(target_info, conn)
+    def _media_path(self, message) -> str | None:
+        """Build path for message media, based on media type.\n
+        **Is not meant to be called directly!**
+        :returns: path to the file or None if media type isn't supported
+        """
+        formatted_date = message.date.strftime("%Y-%m-%d_%H-%M-%S")
 
-        async for message in self.client.iter_messages(self.target, limit=limit, offset_id=offset):
+        if isinstance(message.media, MessageMediaPhoto):
+            return os.path.join(self.media_folder, f"{formatted_date}_{message.id}.jpg")
+        elif isinstance(message.media, MessageMediaDocument):
             try:
-                if Config.stop_event.is_set():
-                    logging.info("Interrupted by user")
-                    break
-                count += 1
-                logging.debug(f"Message #{count} – fetching data")
-                sender_id = message.from_id.user_id if message.from_id else None
-                msg_data = {
-                    'id': message.id,
-                    'text': message.text,
-                    'date': message.date.isoformat(),
-                    'changed_at': message.edit_date.isoformat() if message.edit_date and message.edit_date != message.date else None
-                }
-
-                sender_dict = {}
-                if sender_id:
-                    try:
-                        sender = await safe_call(self.client.get_entity(sender_id), "fetch_messages")
-                        sender_dict['user_id'] = sender_id
-                        sender_dict['first_name'] = sender.first_name if sender.first_name else None
-                        sender_dict['last_name'] = sender.last_name if sender.last_name else None
-                        sender_dict['username'] = sender.username if sender.username else None
-
-                        avatar_path = os.path.join(self.avatar_folder, f"{sender_id}_{sender.first_name}.jpg")
-                        if sender.photo and not os.path.exists(avatar_path):
-                            await safe_call(self.client.download_profile_photo(sender, file=avatar_path))
-
-                        sender_dict['avatar'] = avatar_path if os.path.exists(avatar_path) else None
-                        sender_dict['is_bot'] = True if sender.bot else False
-                    except Exception as e:
-                        logging.warn("An unexpected error occurred during fetching messages: {e}")
-                else:
-                    sender_dict['user_id'] = None
-                    sender_dict['first_name'] = None
-                    sender_dict['last_name'] = None
-                    sender_dict['username'] = None
-                    sender_dict['avatar'] = None
-                    sender_dict['is_bot'] = None
-                msg_data['sender'] = sender_dict
-
-                logging.debug("Searching for replies to message..")
-                if message.replies and await self.get_chat_type() in ["Channel admin", "Channel user"] and Config.download_comments:
-                    logging.debug("Found replies, trying to fetch them.")
-                    async for comment in self.client.iter_messages(self.target, reply_to=message.id):
-                        comment_data = {
-                            'id': comment.id,
-                            'text': comment.text,
-                            'date': comment.date.isoformat(),
-                            'changed_at': comment.edit_date.isoformat() if comment.edit_date and comment.edit_date != comment.date else None,
-                            'user_id': comment.from_id.user_id if comment.from_id else None
-                        }
-                        comments.append(comment_data)
-
-                        msg_data['comments'] = comments if comments else None
-                else:
-                    logging.debug("No replies found for message.")
-
-                msg_data['media'] = None
-
-                if message.media and Config.download_media:
-                    logging.debug(f"Media found. Trying to save it.")
-
-                    formatted_date = message.date.strftime("%Y-%m-%d_%H-%M-%S")
-
-                    if isinstance(message.media, MessageMediaPhoto):
-                        file_path = await safe_call(message.download_media(
-                            file=f"{self.target}/media/{formatted_date}_{message.id}.jpg"), "fetch_messages")
-                        msg_data['media'] = file_path if file_path else None
-                    elif isinstance(message.media, MessageMediaDocument):
-                        try:
-                            guessed_mime = mimetypes.guess_extension(message.media.document.mime_type)
-                            logging.debug(f"Guessed mime: {guessed_mime}")
-                            file_path = await safe_call(message.download_media(
-                                file=f"{self.target}/media/{formatted_date}_{message.id}{guessed_mime}"), "fetch_messages")
-                        except Exception as e:
-                            file_path = await safe_call(message.download_media(
-                                file=f"{self.target}/media/{formatted_date}_{message.id}.file"), "fetch_messages")
-                            logging.warning(f"[ERROR] Error occurred during guessing mime type extension: {e}")
-                        msg_data['media'] = file_path if file_path else None
-                    logging.debug("Media was saved successfully\n")
+                guessed_mime = mimetypes.guess_extension(message.media.document.mime_type)
+                logging.debug("Guessed mime: %s", guessed_mime)
             except Exception as e:
-                logging.warning("Fetch_messages failed.\n{Exception}\nTrying to save data...")
-                break
+                guessed_mime = None
+                logging.warning(f"[ERROR] Error occurred during guessing mime type extension: {e}")
+            return os.path.join(self.media_folder, f"{formatted_date}_{message.id}{guessed_mime or '.file'}")
+        return None
 
-            msg_data['geo'] = None
+    async def _get_sender(self, sender_id: int | None) -> Sender:
+        """Sender of message, interned by id, so it's resolved (and its avatar checked) once per run.\n
+        **Is not meant to be called directly!**"""
+        if not sender_id:
+            return NO_SENDER
+        sender = self.senders.get(sender_id)
+        if sender is not None:
+            return sender
+        try:
+            entity = await self.entities.get_entity(sender_id, "fetch_messages")
+            avatar_path = os.path.join(self.avatar_folder, f"{sender_id}_{entity.first_name}.jpg")
+            return self.senders.add(Sender(
+                user_id=sender_id,
+                first_name=entity.first_name if entity.first_name else None,
+                last_name=entity.last_name if entity.last_name else None,
+                username=entity.username if entity.username else None,
+                avatar=await self._download_avatar(entity, sender_id, avatar_path, "fetch_messages"),
+                is_bot=True if entity.bot else False,
+            ))
+        except Exception as e:
+            # Not interned, so the next message of this user tries again
+            logging.warning(f"An unexpected error occurred during fetching sender {sender_id}: {e}")
+            return Sender(user_id=sender_id)
+
+    async def _process_message(self, message, downloader: MediaDownloader | None,
+                               comment_fetcher: CommentFetcher | None = None, on_ready=None) -> Message:
+        """Build message record, media and comments are queued to their stages (if any).\n
+        **Is not meant to be called directly!**
+        :param on_ready: callback (optional), called with the record once it's written to output (media saved)
+        :returns: Message record
+        """
+        self.message_state.observe(message)
+        sender = getattr(message, "sender", None)
+        if sender is not None and not getattr(sender, "min", False):
+            # Sender comes with the same response, so _get_sender() doesn't have to resolve it
+            self.entities.prime([sender])
+        msg_data = Message(
+            id=message.id,
+            text=message.text,
+            date=message.date.isoformat(),
+            changed_at=message.edit_date.isoformat() if message.edit_date and message.edit_date != message.date else None,
+            sender=await self._get_sender(message.from_id.user_id if message.from_id else None),
+        )
+
+        if comment_fetcher and message.replies and message.replies.replies:
+            logging.debug("Found replies of message %d, queued for fetching", message.id)
+            await comment_fetcher.submit(message.id, msg_data)
+
+        if message.media and hasattr(message.media, "geo") and message.media.geo:
+            msg_data.geo = Geo(latitude=message.media.geo.lat, longitude=message.media.geo.long)
+
+        file_path = self._media_path(message) if message.media and downloader else None
+        if file_path:
+            logging.debug("Media of message %d queued for download", message.id)
+            # Message is written to output when its media download is finished
+            await downloader.submit(message, file_path, msg_data, on_done=lambda _: self._emit_message(msg_data, on_ready))
+        else:
+            await self._emit_message(msg_data, on_ready)
 
-            if message.media and hasattr(message.media, "geo"):
-                geo = message.media.geo
+        return msg_data
 
-                geo_entry = {
-                    "latitude": geo.lat,
-                    "longitude": geo.long
-                }
+    async def _start_stages(self) -> tuple[MediaDownloader | None, CommentFetcher | None]:
+        """Start media and comment stages of message fetching (if turned on).\n
+        **Is not meant to be called directly!**"""
+        downloader = None
+        if Config.download_media:
+            downloader = MediaDownloader(self.client)
+            downloader.start()
+
+        comment_fetcher = None
+        if Config.download_comments and await self.get_chat_type() in ["Channel admin", "Channel user"]:
+            comment_fetcher = CommentFetcher(self)
+            comment_fetcher.start()
+        return downloader, comment_fetcher
+
+    async def _close_stages(self, downloader: MediaDownloader | None, comment_fetcher: CommentFetcher | None):
+        """Wait for media and comment stages to finish, then flush sinks and save message state.\n
+        **Is not meant to be called directly!**"""
+        if downloader:
+            await downloader.close()
+        if comment_fetcher:
+            await comment_fetcher.close()
+        await self.flush_sinks()
+        if os.path.isdir(self.jsons_folder):
+            self.message_state.save()
+
+    async def _emit_message(self, msg_data: Message, on_ready=None):
+        """Write message to output stream, comments are written to their own stream.\n
+        **Is not meant to be called directly!**"""
+        await self._emit("messages", msg_data.to_dict(exclude=("comments",)))
+        if on_ready is not None:
+            on_ready(msg_data)
 
-                msg_data['geo'] = geo_entry if message.media.geo else None
+    @metrics.timed()
+    async def fetch_messages(self, limit=100, offset=0, min_id=0, collect: bool = True,
+                             filters: MessageFilter = None) -> dict:
+        """Fetch messages from group, will save everything to DB, and create JSON file.\n
+        Media is downloaded in background by Config.media_workers workers,
+        'media' field of each message is filled in when its download is finished.
+        Scraped id range is saved to checkpoint, so the next run can be incremental
+        (except filtered runs, which don't scrape the whole range).\n
+        **Usage:** await bot.fetch_messages(limit=None, min_id=bot.checkpoint.max_id)
+        :param limit: max number of messages, None to fetch all of them
+        :param offset: fetch messages older than this id (0 to start from the newest)
+        :param min_id: fetch messages newer than this id only
+        :param collect: Set to False to keep messages only in output stream, returned list will be empty
+        :param filters: MessageFilter (date range, sender, keyword, media type), applied by telegram where possible
+        :returns: dict with messages (newest first)
+        """
+        target_info = await self.fetch_target_info()
+        messages = []
+        async for msg_data in self.stream_messages(limit=limit, offset=offset, min_id=min_id, filters=filters):
+            if collect:
+                messages.append(msg_data)
+        # Messages with media are yielded when their download is finished, restore id order
+        messages.sort(key=lambda msg: msg.id, reverse=True)
+        return {"target": target_info, "messages": messages}
+
+    async def stream_messages(self, limit=100, offset=0, min_id=0, filters: MessageFilter = None):
+        """Async generator of messages, each one is yielded as soon as it's complete (media saved),
+        so messages with media may come after newer ones. Records are written to output stream and DB
+        sinks as well, comment threads are fetched in background and fill in 'comments' later.\n
+        Telegram cursor isn't moved while the consumer is busy, so slow consumer slows down fetching
+        instead of piling messages up in memory. Consumer which stops early should close the generator
+        (contextlib.aclosing), so stages are stopped and checkpoint is saved right away.\n
+        **Usage:**
+            async with aclosing(bot.stream_messages(limit=None)) as messages:
+                async for msg_data in messages: ...
+        :param limit: max number of messages, None to fetch all of them
+        :param offset: fetch messages older than this id (0 to start from the newest)
+        :param min_id: fetch messages newer than this id only
+        :param filters: MessageFilter (date range, sender, keyword, media type), applied by telegram where possible
+        """
+        logging.info("Started fetching messages")
 
-            messages.append(msg_data)
+        count = 0
+        ready = deque()  # complete messages, not yielded yet
+        progress = Progress("fetch_messages", "messages")
 
-            if len(messages) > 100 and Config.save_to_db:
-                insert_message(messages, target_info["id"], conn)
+        downloader, comment_fetcher = await self._start_stages()
 
-        if messages and Config.save_to_db:
-            insert_message(messages, target_info["id"], conn)
-            messages.clear()
+        run_min, run_max = None, None
+        exhausted = False
 
-        res = {"target": target_info, "messages": messages}
+        filters = filters or None
+        kwargs = filters.to_kwargs() if filters else {}
+        client_side = filters is not None and not filters.server_only()
+        if filters:
+            logging.info(f"Fetching messages matching {filters}")
 
-        if Config.save_to_db:
-            logging.info("All result saved to configured DB")
-        logging.info("Finished fetching messages")
-        return res
+        try:
+            def messages_from(last=None):
+                # After FloodWait iteration continues below the last received message
+                remaining = limit if client_side or limit is None else limit - count
+                return self.client.iter_messages(self.target, limit=None if client_side else remaining,
+                                                 offset_id=last.id if last else offset, min_id=min_id or 0, **kwargs)
+
+            async for message in limited(messages_from(), "get_messages", resume=messages_from):
+                if Config.stop_event.is_set():
+                    logging.info("Interrupted by user")
+                    break
+                if filters and filters.is_past(message):
+                    break
+                if client_side and not filters.matches(message):
+                    continue
+                count += 1
+                try:
+                    await self._process_message(message, downloader, comment_fetcher, on_ready=ready.append)
+                except Exception as e:
+                    logging.warning(f"Fetch_messages failed.\n{e}\nTrying to save data...")
+                    break
+
+                metrics.inc("messages")
+                progress.update()
+                run_min = message.id if run_min is None else min(run_min, message.id)
+                run_max = message.id if run_max is None else max(run_max, message.id)
 
-    async def get_members(self) -> dict | None:
-        """Try to fetch a list with all group members, if possible.\n
-        Group members can be fetched in channels only if our user is admin
+                while ready:
+                    yield ready.popleft()
+                if client_side and limit is not None and count >= limit:
+                    break
+            else:
+                exhausted = limit is None or count < limit
+            if downloader:
+                # Remaining downloads are finished before the generator is done
+                await downloader.close()
+                downloader = None
+            while ready:
+                yield ready.popleft()
+        finally:
+            await self._close_stages(downloader, comment_fetcher)
+            if not filters:
+                self._save_checkpoint(run_min, run_max, offset, min_id, exhausted)
+            self.save_entity_cache()
+            if Config.save_to_db:
+                logging.info("All result saved to configured DB")
+            progress.finish()
+
+    def _save_checkpoint(self, run_min, run_max, offset, min_id, exhausted: bool):
+        """Merge id range scraped by fetch_messages() into checkpoint.\n
+        Range starts right below offset (if given) and reaches min_id if all messages newer than it were fetched.\n
+        **Is not meant to be called directly!**"""
+        high = offset - 1 if offset else run_max
+        low = min_id + 1 if exhausted and min_id else run_min
+        self.checkpoint.merge_range(low, high)
+        if os.path.isdir(self.jsons_folder):
+            self.checkpoint.save()
+            logging.info(f"Checkpoint saved, scraped range: {self.checkpoint.min_id}..{self.checkpoint.max_id}")
+
+    @metrics.timed()
+    async def backfill_messages(self, shards: int = None, collect: bool = True) -> dict:
+        """Fetch whole message history (ids not scraped yet) by concurrent shards, see Backfill.\n
+        Interrupted backfill is resumed from checkpoint by the next call.\n
+        **Usage:** await bot.backfill_messages(shards=8, collect=False)
+        :param shards: number of id ranges fetched concurrently, Config.backfill_shards by default
+        :param collect: Set to False to keep messages only in output stream, returned list will be empty
+        :returns: dict with messages (newest first)
+        """
+        return await Backfill(self, shards, collect).run()
+
+    @metrics.timed()
+    async def verify_messages(self, window: int = None) -> list:
+        """Re-fetch the newest scraped messages in bulk and emit only what changed since they were scraped
+        (edited, deleted, replies, reactions) to "message_deltas" stream and DB sinks, see Verifier.\n
+        **Usage:** await bot.verify_messages(window=1000)
+        :param window: number of the newest message ids to verify, Config.verify_window by default
+        :returns: list with MessageDelta records
+        """
+        return await Verifier(self, window).run()
+
+    @metrics.timed()
+    async def refresh_comments(self, post_ids: list[int]) -> dict:
+        """Fetch only new comments (newer than the last seen one) of posts scraped in earlier runs.\n
+        Threads are fetched concurrently by Config.comment_workers workers.\n
+        **Usage:** await bot.refresh_comments([120, 121])
+        :returns: dict {post_id: list with new comments}
+        """
+        logging.info(f"Started refreshing comments of {len(post_ids)} posts")
+        records = {post_id: {} for post_id in post_ids}
+        comment_fetcher = CommentFetcher(self)
+        comment_fetcher.start()
+        try:
+            for post_id, record in records.items():
+                await comment_fetcher.submit(post_id, record)
+        finally:
+            await comment_fetcher.close()
+            await self.flush_sinks()
+            if os.path.isdir(self.jsons_folder):
+                self.checkpoint.save()
+        logging.info("Finished refreshing comments")
+        return {post_id: record.get('comments') or [] for post_id, record in records.items()}
+
+    @metrics.timed()
+    async def get_members(self, collect: bool = True) -> dict | None:
+        """Export all group members, if possible.\n
+        Group members can be fetched in channels only if our user is admin.
+        Members are streamed to "participants" output as they arrive (see MemberExporter).
         **Usage:** bot.get_members()
+        :param collect: Set to False to keep members only in output stream, returned list will be empty
         :returns: dict with group/channel participants
         """
-        logging.info("Started fetching group members")
-
         if Config.stop_event.is_set():
             logging.info("Interrupted by user")
             return None
 
-        users = []
-        users_dict = {"target": self.target}
-        users_list = []
+        users_dict = {"target": self.target, "participants": []}
+        async for member in self.stream_members():
+            if collect:
+                users_dict["participants"].append(member)
+        return users_dict
+
+    async def stream_members(self):
+        """Async generator of group members, each one is yielded as soon as its avatar is saved.
+        Next page of participants is requested only when the consumer asks for more (see MemberExporter).\n
+        **Usage:** async for member in bot.stream_members(): ...
+        """
+        logging.info("Started fetching group members")
 
         chat_type = await self.get_chat_type()
 
         if chat_type in ["Mega group", "Channel admin", "Chat group"]:
-            users = await safe_call(self.client.get_participants(self.target), "get_members")
+            if self.output:
+                # Members are a snapshot, not appended to the previous run
+                self.output.reset("participants")
+            exporter = MemberExporter(self)
+            try:
+                async for member in exporter.stream(expected=await self.participants_count()):
+                    yield member
+            finally:
+                self.save_entity_cache()
         elif chat_type == "Channel user":
             logging.info("Cannot fetch members. You're not an admin")
             print("Cannot fetch members. You're not an admin.")
@@ -386,27 +685,4 @@ class Scraper:
             logging.info("Cannot fetch members. Unknown chat_type.")
             print("Cannot fetch members. Unknown chat_type.")
 
-        if users:
-            for user in users:
-                user_entity = await self.client.get_entity(user)
-
-                participant_path = self.participants_avatars_folder + f"/{user.id}_{user.first_name}.jpg"
-
-                user_data = {
-                    'user_id': user.id,
-                    'username': user.username,
-                    'first_name': user.first_name,
-                    'last_name': user.last_name,
-                }
-
-                if user.photo and not os.path.exists(participant_path):
-                    await safe_call(self.client.download_profile_photo(user_entity, file=participant_path), "get_members")
-
-                user_data['avatar'] = participant_path if os.path.exists(participant_path) else None
-                users_list.append(user_data)
-
-        users_dict["participants"] = users_list
-
         logging.info("Finished fetching members")
-
-        return users_dict
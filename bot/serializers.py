@@ -0,0 +1,98 @@
+import json
+from bot.settings import Config, logging
+from .records import Record
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _default(obj):
+    """Serialize records (and anything else with to_dict()) as dicts"""
+    if isinstance(obj, Record) or hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class JsonSerializer:
+    """Stdlib json, pretty (indent=4, the old output layout) or compact.\n
+    Every serializer has the same interface: dumps(obj) -> str, loads(str) and dump(obj, file).
+    """
+    name = "json"
+
+    def __init__(self, pretty: bool = False):
+        self.pretty = pretty
+        self._kwargs = {"indent": 4} if pretty else {"separators": (",", ":")}
+
+    def dumps(self, obj) -> str:
+        return json.dumps(obj, ensure_ascii=False, default=_default, **self._kwargs)
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+    def dump(self, obj, f):
+        f.write(self.dumps(obj))
+
+
+class OrjsonSerializer(JsonSerializer):
+    """orjson backend, compact output only"""
+    name = "orjson"
+
+    def dumps(self, obj) -> str:
+        return orjson.dumps(obj, default=_default).decode("utf-8")
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data)
+
+
+class MsgspecSerializer(JsonSerializer):
+    """msgspec backend, compact output only"""
+    name = "msgspec"
+
+    def __init__(self, pretty: bool = False):
+        super().__init__(pretty)
+        self._encoder = msgspec.json.Encoder(enc_hook=_default)
+        self._decoder = msgspec.json.Decoder()
+
+    def dumps(self, obj) -> str:
+        return self._encoder.encode(obj).decode("utf-8")
+
+    def loads(self, data):
+        try:
+            return self._decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+
+BACKENDS = {
+    "json": (JsonSerializer, lambda: True),
+    "orjson": (OrjsonSerializer, lambda: orjson is not None),
+    "msgspec": (MsgspecSerializer, lambda: msgspec is not None),
+}
+_serializers = {}
+
+
+def get_serializer(pretty: bool = False, backend: str = None) -> JsonSerializer:
+    """Shared serializer of given backend (Config.serializer by default).\n
+    "auto" picks orjson, then msgspec, then stdlib json. Pretty output is always written by stdlib json,
+    so whole-document files keep their old layout.\n
+    **Usage:** get_serializer().dumps(record)
+    """
+    key = ("json" if pretty else backend or Config.serializer, pretty)
+    if key not in _serializers:
+        name = key[0]
+        if name == "auto":
+            name = next(name for name in ("orjson", "msgspec", "json") if BACKENDS[name][1]())
+        elif not BACKENDS[name][1]():
+            logging.warning(f"{name} is not installed, falling back to json serializer")
+            name = "json"
+        _serializers[key] = BACKENDS[name][0](pretty)
+    return _serializers[key]
@@ -1,34 +1,123 @@
 import os
 from dotenv import load_dotenv
-from telethon import TelegramClient
 from threading import Event
 import logging
 
 load_dotenv(dotenv_path='.env')
 
+STAGES = ("messages", "participants", "pinned_messages", "target_info", "admin_logs", "message_deltas") # Stages of scrape_target
+ADMIN_LOG_EVENTS = ("join", "leave", "invite", "restrict", "unrestrict", "ban", "unban", "promote", "demote",
+                    "info", "settings", "pinned", "edit", "delete", "group_call") # Event type filters of iter_admin_log
+
+
+class _LazyClient:
+    """Builds TelegramClient on first access of Config.client, so importing bot stays fast
+    and commands which don't talk to telegram (e.g. --help) work without API_ID.\n
+    **Is not meant to be used directly!**"""
+    def __get__(self, instance, owner):
+        from telethon import TelegramClient
+
+        if not owner.API_ID or not owner.API_HASH:
+            raise RuntimeError("API_ID and API_HASH have to be set in .env file")
+        client = TelegramClient(owner.session_name, api_id=int(owner.API_ID), api_hash=owner.API_HASH)
+        owner.client = client  # replaces descriptor, client is built only once
+        return client
+
 
 class Config:
     """Config class, used for specifying parameters that can be changed.\n
     **Change only if you know what you're doing.**
     """
-    API_ID = int(os.getenv('API_ID'))
+    API_ID = os.getenv('API_ID')
     API_HASH = os.getenv('API_HASH')
-    client = TelegramClient("session_name", api_id=API_ID, api_hash=API_HASH)
+    session_name = "session_name"
+    client = _LazyClient() # TelegramClient, built on first use
+    sessions = [] # Session files of accounts Scheduler spreads targets across (see bot/pool.py), Config.client if less than 2
     save_to_db = False  # Do not turn on! (yet)
+    db_batch_size = 500 # Number of records written to DB in one transaction
+    db_flush_interval = 2 # Seconds after which not full batch is written anyway
+    db_queue_size = 10000 # Max number of records waiting for DB writer
+    save_to_sqlite = False # Also save everything to embedded SQLite archive (no database server needed)
+    sqlite_path = "archive.sqlite3" # Shared by all targets
     max_attempts = 3
+    backoff_base = 1 # Seconds, delay before retry grows as backoff_base * 2^attempt (with random jitter)...
+    backoff_max = 60 # ...but isn't longer than backoff_max
+    max_flood_wait = 3600 # Calls which would have to wait longer than this after FloodWait are given up
+    rpc_rates = { # RPC class: (requests per second, burst), shared by all Scraper instances
+        "get_entity": (5, 10),
+        "get_messages": (3, 5),
+        "download": (10, 20),
+        "get_participants": (2, 5),
+        "default": (5, 10),
+    }
+    max_concurrent_requests = 8 # Requests in flight at the same time, shared by all scraped targets (per session)
+    scheduler_concurrency = 4 # Targets scraped at the same time by Scheduler
+    scrape_stages = [stage for stage in STAGES if stage != "message_deltas"] # Stages run by scrape_target
     stop_event = Event()
 
+    backfill = False # Fetch full history (runs without min_id) by concurrent id range shards, see bot/backfill.py
+    backfill_shards = 8 # Number of id ranges fetched at the same time
+    backfill_min_shard_size = 1000 # Ids, smaller histories are split into fewer shards
+    backfill_save_interval = 30 # Seconds between checkpoint saves while backfill runs, crashed run resumes from there
+
+    verify_window = 1000 # Number of the newest messages re-verified by "message_deltas" stage (edits, deletions...)
+    verify_batch_size = 100 # Message ids per get_messages request (100 at most)
+
+    admin_log_events = [] # Admin log event types to fetch (see ADMIN_LOG_EVENTS), empty for all
+
     download_media = True # Turn this off if you need to download text only
     download_comments = True # Turn this off if you don't need to download comments (replies)
+    comment_workers = 4 # Number of comment threads fetched at the same time
+    comments_queue_size = 100 # Max number of posts waiting for comment fetching
+    max_comments_per_post = None # Fetch at most N newest comments of each post, None for all of them
+    refresh_comments_posts = 100 # Incremental runs fetch new comments of N newest posts of earlier runs, 0 to turn off
+    checkpoint_comment_posts = 1000 # Newest posts whose last fetched comment is kept in checkpoint (None for all)
+    media_workers = 4 # Number of concurrent media downloads
+    media_queue_size = 100 # Max number of media waiting for download, message loop waits when queue is full
+    max_media_size = None # Bytes, bigger documents are skipped (None for no limit)
+    defer_media_size = None # Bytes, bigger documents are downloaded after all the others (None to keep order)
+    chunked_download_min_size = 10 * 1024 * 1024 # Bytes, bigger documents are downloaded in resumable chunks (.part files)
+    download_chunk_size = 512 * 1024 # Bytes per request of chunked download (multiple of 4096 dividing 1 MB)
+    download_parts = 4 # Max number of byte ranges of one file downloaded in parallel...
+    download_part_min_size = 32 * 1024 * 1024 # ...each range at least this big
+    download_state_interval = 5 # Seconds between saves of chunked download progress (<path>.part.json)
+    use_media_store = True # Keep media and avatars in shared store, deduplicated by telegram photo/document id
+    media_store_folder = "media_store" # Shared by all targets, per-target files are links to it
+    media_store_hash = False # Also deduplicate files by sha256 of their content (slower)
+    avatar_workers = 4 # Number of concurrent participant avatar downloads
+    avatar_queue_size = 100 # Max number of avatars waiting for download
+    members_listing_cap = 10000 # Telegram returns at most ~N members for one listing (or search query)
+    members_search_alphabet = "abcdefghijklmnopqrstuvwxyz0123456789" # Search queries used to get past the cap
+    members_search_depth = 2 # Max length of search query, queries hitting the cap are extended by one character
+
+    entity_cache_size = 10000 # Max number of cached entities (users, channels)
+    entity_cache_ttl = 6 * 60 * 60 # Seconds after which cached entity is resolved again
+    persist_entity_cache = True # Save entity cache next to jsons folder, so the next run starts warm
+
+    stream_output = True # Append every record to jsons/<kind>.jsonl as soon as it's produced
+    output_compression = None # None, "gzip" or "zstd" (requires zstandard package)
+    output_flush_every = 100 # Flush output files every N records...
+    output_flush_interval = 5 # ...or every N seconds
+    finalize_json = True # Build messages.json from messages.jsonl when scraping is finished
+    finalize_chunk_size = 100000 # Records sorted in memory at once by finalize, bigger outputs are merged from temporary files
+    serializer = "auto" # "auto" (orjson or msgspec when installed), "orjson", "msgspec" or "json"
+    pretty_json = True # Indent whole-document JSON files (messages.json...), turn off for smaller and faster output
+
+    metrics_folder = "metrics" # metrics.json and metrics.prom (Prometheus text format) are written here...
+    metrics_interval = 30 # ...every N seconds
+
+    log_file = os.getenv('LOG_FILE', "logs.log")
+    log_level = os.getenv('LOG_LEVEL', "DEBUG") # "INFO" is a lot faster on big channels
+    log_queue = True # Write log file from background thread, so logging doesn't block the event loop
+    log_debug_rate = 20 # Max DEBUG lines per second from one function, the rest are dropped (None for all)
+    log_progress_interval = 10 # Seconds between progress lines of long loops (messages, members)
+
+    @staticmethod
+    def setup_logging(level: str = None, filename: str = None):
+        """Configure file logging (see bot/logs.py), called by entry points (importing bot doesn't touch logging)"""
+        from bot.logs import setup_logging
 
-    logging.basicConfig(
-        filename="logs.log",
-        encoding="utf-8",
-        # level=logging.INFO,
-        level=logging.DEBUG,
-        format="[%(asctime)s][%(name)s][%(funcName)s] %(levelname)s - %(message)s",
-        datefmt="%d.%m, %H:%M:%S"
-    )
+        setup_logging(level or Config.log_level, filename or Config.log_file)
 
     @staticmethod
     def get_folders(target_channel):
@@ -0,0 +1,19 @@
+from datetime import datetime
+
+
+class TargetContext:
+    """Resolved target of Scraper run: entity, chat type, permissions and basic info.\n
+    Resolved once by Scraper.resolve_target() and reused by every Scraper method,
+    call Scraper.resolve_target(refresh=True) to resolve it again.
+    """
+    __slots__ = ("entity", "chat_type", "permissions", "info", "resolved_at")
+
+    def __init__(self, entity, chat_type: str, permissions=None, info: dict = None):
+        self.entity = entity
+        self.chat_type = chat_type
+        self.permissions = permissions
+        self.info = info
+        self.resolved_at = datetime.now()
+
+    def __repr__(self):
+        return f"TargetContext(id={self.entity.id}, chat_type={self.chat_type!r})"
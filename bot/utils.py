@@ -1,8 +1,16 @@
+import asyncio
+import functools
+import inspect
 import json
+import os
 import time
 
 from .settings import Config, logging
 from telethon.errors import FloodWaitError
+from .checkpoint import Checkpoint
+from .ratelimit import get_limiter, backoff_delay
+from .metrics import metrics
+from .serializers import get_serializer
 
 
 def dump_json(data, filename: str):
@@ -10,55 +18,112 @@ def dump_json(data, filename: str):
     Dumps info in json file.\n
     Filename can be used for specifying path too.
     """
-    with open(f'{filename}.json', 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    with metrics.timer("json_write"), open(f'{filename}.json', 'w', encoding='utf-8') as f:
+        get_serializer(pretty=Config.pretty_json).dump(data, f)
 
 
 def get_last_message_id(filename: str):
     """
-    Reads last saved message ID from messages.json file.\n
+    Reads last (highest) saved message ID.\n
+    Uses checkpoint.json next to the file if it exists, otherwise falls back to parsing messages.json.
     :param filename: path to JSON file
     """
+    checkpoint = Checkpoint.load(os.path.join(os.path.dirname(filename), "checkpoint.json"))
+    if checkpoint.max_id is not None:
+        return checkpoint.max_id
+
     try:
         with open(filename, 'r', encoding='utf-8') as f:
             data = dict(json.load(f))
-            try:
-                return data["messages"][0]["id"]
-            except KeyError:
+            messages = data.get("messages")
+            # Older dumps were nested as {"messages": {"target": ..., "messages": [...]}}
+            if isinstance(messages, dict):
+                messages = messages.get("messages")
+            if not messages:
                 logging.warning("[get_last_message_id] Couldn't find message ID in messages.json")
                 return 0
+            return max(message["id"] for message in messages)
     except FileNotFoundError:
         logging.warning("[get_last_message_id] File messages.json doesn't exist")
         return 0
 
 
-async def safe_call(coro, method_name="unknown"):
+def request_slots() -> asyncio.Semaphore:
+    """Semaphore shared by all Scraper instances (of one pool session), limits number of requests in flight.\n
+    Waiting calls get slots in order of arrival, so concurrently scraped targets get a fair share of them.
     """
-    This method used to make safe calls, and stabilising them with try except expression.
-    :param coro: coroutine,
+    return get_limiter().slots
+
+
+async def safe_call(factory, method_name="unknown", rpc_class="default", use_slot=True, raise_on=()):
+    """
+    This method used to make safe calls, and stabilising them with try except expression.\n
+    Every attempt takes a token from shared rate limiter of given RPC class. FloodWait pauses the whole
+    RPC class for all tasks, other exceptions are retried with jittered exponential backoff.\n
+    **Usage:** await safe_call(lambda: client.get_entity("durov"), "get_entity", rpc_class="get_entity")
+    :param factory: function returning new coroutine for each attempt (plain coroutine can't be retried),
     :param method_name: method name (optional), used to make debugging easier.
+    :param rpc_class: RPC class of rate limiter: get_entity, get_messages, download, get_participants or default.
+    :param use_slot: Set to False for long calls (e.g. media downloads), which shouldn't hold request slot.
+    :param raise_on: exceptions which are not retried, but raised to the caller.
     """
+    if asyncio.iscoroutine(factory):
+        coro, factory = factory, None
+    limiter = get_limiter()
     attempts = 0
     max_attempts = Config.max_attempts
     while True:
+        await limiter.acquire(rpc_class)
+        call = factory() if factory else coro
         try:
-            return await coro
+            if not use_slot:
+                return await call
+            async with request_slots():
+                return await call
+        except raise_on:
+            raise
         except FloodWaitError as e:
+            limiter.pause(rpc_class, e.seconds)
+            if factory is None or e.seconds > Config.max_flood_wait:
+                print(f"[FloodWait] - [{method_name}] Too many requests sent! Can't wait for {e.seconds} seconds, giving up.")
+                limiter.count(rpc_class, "failures")
+                return None
             print(f"[FloodWait] - [{method_name}] Too many requests sent! Waiting for {e.seconds} seconds...")
         except Exception as e:
-            if attempts > max_attempts:
+            attempts += 1
+            if attempts > max_attempts or factory is None:
                 print(f"Error during calling method \"{method_name}\". Program used all of {max_attempts} available attempts.")
+                logging.warning(f"[safe_call] {method_name} failed: {e}")
+                limiter.count(rpc_class, "failures")
                 return None
-            print(f"[Exception] - [{method_name}] Unexpected exception occurred: {e}\nRetrying...")
-            attempts += 1
+            delay = backoff_delay(attempts)
+            limiter.count(rpc_class, "retries")
+            print(f"[Exception] - [{method_name}] Unexpected exception occurred: {e}\nRetrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
 
 
 def record_time(func):
+    """Prints how long function took and records it to bot.metrics, works with sync and async functions"""
+    def report(start_time):
+        total = time.time() - start_time
+        metrics.observe(func.__name__, total)
+        print(f"[record_time] {func.__name__} took {total} seconds")
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start_time = time.time()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                report(start_time)
+        return async_wrapper
+
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        total = end_time - start_time
-        print(f"[record_time] {func.__name__} took {total} seconds")
-        return result
-    return wrapper
\ No newline at end of file
+        try:
+            return func(*args, **kwargs)
+        finally:
+            report(start_time)
+    return wrapper
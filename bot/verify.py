@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime
+from bot.settings import Config, logging
+from .media_store import MediaStore
+from .utils import safe_call
+from .metrics import metrics
+from .records import MessageDelta
+
+
+def content_hash(message) -> str:
+    """Short hash of message text and media identity"""
+    content = f"{message.text or ''}\0{MediaStore.media_key(message.media) or ''}"
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def reactions_of(message) -> dict:
+    """Reaction counts of message, {emoticon (or custom emoji document id): count}"""
+    reactions = getattr(message, "reactions", None)
+    res = {}
+    for reaction_count in getattr(reactions, "results", None) or []:
+        reaction = reaction_count.reaction
+        key = getattr(reaction, "emoticon", None) or str(getattr(reaction, "document_id", None) or type(reaction).__name__)
+        res[key] = reaction_count.count
+    return res
+
+
+class MessageState:
+    """Last seen state of the newest messages (jsons/message_state.json): content hash, edit date,
+    reply count and reactions of each message, used to detect what changed since.\n
+    Only Config.verify_window newest messages are kept.\n
+    **Usage:**
+        state = MessageState.load("durov/jsons/message_state.json")
+        changes = state.observe(message)
+        state.save()
+    """
+    def __init__(self, path: str, window: int = None):
+        self.path = path
+        self.window = window or Config.verify_window
+        self.messages = {}  # message id -> [hash, edit date, replies, reactions]
+
+    @classmethod
+    def load(cls, path: str, window: int = None) -> "MessageState":
+        state = cls(path, window)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state.messages = {int(key): value for key, value in json.load(f).items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"[MessageState] Couldn't read {path}: {e}")
+        return state
+
+    def save(self):
+        self.prune()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.messages, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def prune(self):
+        """Keep only `window` newest messages"""
+        if len(self.messages) > self.window:
+            for message_id in sorted(self.messages)[:len(self.messages) - self.window]:
+                del self.messages[message_id]
+
+    def observe(self, message) -> list[str]:
+        """Remember current state of message.
+        :returns: list of changes since the last time it was seen ("edited", "replies", "reactions"),
+            empty for messages seen for the first time
+        """
+        entry = [
+            content_hash(message),
+            message.edit_date.isoformat() if message.edit_date else None,
+            message.replies.replies if message.replies else 0,
+            reactions_of(message),
+        ]
+        previous = self.messages.get(message.id)
+        self.messages[message.id] = entry
+        if len(self.messages) > 2 * self.window:
+            self.prune()
+        if previous is None:
+            return []
+
+        changes = []
+        if previous[0] != entry[0] or previous[1] != entry[1]:
+            changes.append("edited")
+        if previous[2] != entry[2]:
+            changes.append("replies")
+        if previous[3] != entry[3]:
+            changes.append("reactions")
+        return changes
+
+    def forget(self, message_id: int):
+        self.messages.pop(message_id, None)
+
+
+class Verifier:
+    """Re-verify the newest scraped messages and emit only what changed.\n
+    Ids of the last `window` messages (up to checkpoint.max_id) are re-fetched in bulk with
+    get_messages(ids=[...]), `batch_size` ids per request, batches run concurrently under the rate limiter.
+    Each message is compared with its state from MessageState, and one MessageDelta per changed message
+    (edited, deleted, replies, reactions) is written to "message_deltas" stream and DB sinks.\n
+    **Usage:**
+        deltas = await Verifier(bot, window=1000).run()
+    """
+    def __init__(self, scraper, window: int = None, batch_size: int = None):
+        self.scraper = scraper
+        self.window = window or Config.verify_window
+        self.batch_size = min(batch_size or Config.verify_batch_size, 100)  # telegram returns at most 100 per request
+        self.deltas = []
+
+    async def run(self) -> list[MessageDelta]:
+        max_id = self.scraper.checkpoint.max_id
+        if not max_id:
+            logging.info("Nothing to verify, no messages were scraped yet")
+            return []
+        ids = list(range(max(1, max_id - self.window + 1), max_id + 1))
+        batches = [ids[n:n + self.batch_size] for n in range(0, len(ids), self.batch_size)]
+        logging.info(f"Verifying messages {ids[0]}..{ids[-1]} in {len(batches)} batches")
+
+        await asyncio.gather(*(self._verify_batch(batch) for batch in batches))
+        await self.scraper.flush_sinks()
+        if os.path.isdir(self.scraper.jsons_folder):
+            self.scraper.message_state.save()
+        logging.info(f"Verified {len(ids)} messages, {len(self.deltas)} changed")
+        return sorted(self.deltas, key=lambda delta: delta.id, reverse=True)
+
+    async def _verify_batch(self, ids: list[int]):
+        if Config.stop_event.is_set():
+            return
+        messages = await safe_call(lambda: self.scraper.client.get_messages(self.scraper.target, ids=ids),
+                                   "verify_messages", rpc_class="get_messages")
+        if messages is None:
+            logging.warning(f"[Verifier] Failed to fetch messages {ids[0]}..{ids[-1]}, skipped")
+            return
+
+        state = self.scraper.message_state
+        detected_at = datetime.now().isoformat()
+        for message_id, message in zip(ids, messages):
+            metrics.inc("verified_messages")
+            if message is None or type(message).__name__ == "MessageEmpty":
+                if message_id in state.messages:
+                    state.forget(message_id)
+                    await self._emit(MessageDelta(id=message_id, changes=["deleted"], detected_at=detected_at))
+                continue
+            changes = state.observe(message)
+            if changes:
+                await self._emit(MessageDelta(
+                    id=message_id,
+                    changes=changes,
+                    text=message.text if "edited" in changes else None,
+                    changed_at=message.edit_date.isoformat() if message.edit_date else None,
+                    replies=message.replies.replies if message.replies else 0,
+                    reactions=reactions_of(message),
+                    detected_at=detected_at,
+                ))
+
+    async def _emit(self, delta: MessageDelta):
+        metrics.inc("message_deltas")
+        self.deltas.append(delta)
+        await self.scraper._emit("message_deltas", delta)
@@ -0,0 +1,45 @@
+import asyncio
+from database.config import load_config
+from database.connect import connect
+from database.queries import insert_group_info, insert_message, insert_pinned_messages
+from database.writer import BatchWriter
+
+
+class PostgresWriter(BatchWriter):
+    """Background PostgreSQL writer, fed by a queue (see BatchWriter).\n
+    **Usage:**
+        writer = PostgresWriter(target_info)
+        await writer.write("messages", msg_data)
+        await writer.close()
+    """
+    HANDLERS = {
+        "messages": insert_message,
+        "pinned_messages": insert_pinned_messages,
+    }
+
+    def __init__(self, group_info: dict, config: dict = None, batch_size: int = 500,
+                 flush_interval: float = 2.0, queue_size: int = 10000, on_flush=None):
+        self.config = config or load_config()
+        super().__init__(group_info, batch_size=batch_size, flush_interval=flush_interval,
+                         queue_size=queue_size, on_flush=on_flush)
+
+    def _open(self):
+        conn = connect(self.config)
+        if conn is None:
+            raise ConnectionError("Failed to connect to the database.")
+        insert_group_info(self.group_info, conn)
+        return conn
+
+
+async def main():
+    writer = PostgresWriter({"id": 0, "title": "test", "username": "test", "about": None}, batch_size=2)
+    sender = {"user_id": 1, "first_name": "Test", "last_name": None, "username": None, "avatar": None, "is_bot": False}
+    for i in range(5):
+        await writer.write("messages", {"id": i, "text": f"message\t{i}", "date": "2025-01-01T00:00:00", "changed_at": None,
+                                        "sender": sender, "media": None, "geo": {"latitude": 1.0, "longitude": 2.0}})
+    await writer.close()
+    print(f"Written {writer.written} messages")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,39 +1,54 @@
+from io import StringIO
 from psycopg2.extras import execute_values
 
 
-def insert_user(element, conn):
+def insert_users(users, conn):
+    """Bulk upsert of message senders, users are deduplicated by user_id"""
+    unique = {}
+    for user in users:
+        if user and user.get("user_id"):
+            unique[user["user_id"]] = user
+    if not unique:
+        return
+
     with conn.cursor() as cursor:
-        cursor.execute(
+        execute_values(
+            cursor,
             """INSERT INTO users (user_id, first_name, last_name, username, avatar, is_bot)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (user_id) DO NOTHING
-            RETURNING user_id;
-            """, (
-            element["sender"]["user_id"], element["sender"]["first_name"], element["sender"]["last_name"], element["sender"]["username"],
-            element["sender"]["avatar"], element["sender"]["is_bot"])
+            VALUES %s
+            ON CONFLICT (user_id) DO NOTHING;
+            """,
+            [(u["user_id"], u["first_name"], u["last_name"], u["username"], u["avatar"], u["is_bot"])
+             for u in unique.values()]
         )
 
 
-def insert_geo(el, group_id, conn, geo_ids):
-    geo = el.get("geo")
-    if not geo:
-        return None
-
-    lat, lon = geo.get("latitude"), geo.get("longitude")
-    if (lat, lon) in geo_ids:
-        return geo_ids[(lat, lon)]
+def insert_geos(batch, group_id, conn):
+    """Bulk insert of geo locations, locations are deduplicated by (latitude, longitude) per batch.
+    :returns: dict {(latitude, longitude): geo_id}
+    """
+    unique = {}
+    for el in batch:
+        geo = el.get("geo")
+        if geo:
+            key = (geo.get("latitude"), geo.get("longitude"))
+            if key not in unique:
+                unique[key] = (el["id"], group_id, el["sender"].get("user_id"), key[0], key[1])
+    if not unique:
+        return {}
 
     with conn.cursor() as cursor:
-        cursor.execute(
+        rows = execute_values(
+            cursor,
             """
             INSERT INTO geo_locations (m_id, group_id, sender_id, latitude, longitude)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING id;
-            """, (el['id'], group_id, el['sender']['user_id'], lat, lon)
+            VALUES %s
+            RETURNING id, latitude, longitude;
+            """,
+            list(unique.values()),
+            fetch=True
         )
-        geo_id = cursor.fetchone()[0]
-        geo_ids[(lat, lon)] = geo_id
-        return geo_id
+    return {(lat, lon): geo_id for geo_id, lat, lon in rows}
 
 
 def insert_group_info(group_info, conn):
@@ -51,42 +66,53 @@ def insert_group_info(group_info, conn):
                 ON CONFLICT (group_id) DO NOTHING;
             """, entry
         )
+    conn.commit()
+
+
+def _copy_value(value):
+    """Format value for COPY text format"""
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_rows(rows, table, columns, conn):
+    """Load rows into table with COPY, much faster than INSERT for big batches"""
+    buffer = StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(value) for value in row) + "\n")
+    buffer.seek(0)
+
+    with conn.cursor() as cursor:
+        cursor.copy_from(buffer, table, columns=columns)
 
 
 def insert_message(batch, group_id, conn):
-    print(f"\n\n–––BATCH INFO–––\n\nBatch length: {len(batch)}\nContent: {batch}")
+    """Insert batch of messages in one transaction: users and geo locations are upserted in bulk,
+    messages are loaded with COPY."""
     if conn is None:
         print("Failed to connect to the database.")
         return
 
-    geo_ids = {}
-    values = []
+    insert_users([el["sender"] for el in batch], conn)
+    geo_ids = insert_geos(batch, group_id, conn)
 
-    with conn.cursor() as cursor:
-        for el in batch:
-            if el["sender"]["user_id"]:
-                insert_user(el, conn)
-
-            geo_id = insert_geo(el, group_id, conn, geo_ids)
-
-            values.append((
-                el["id"],
-                el["text"],
-                el["date"],
-                el["changed_at"],
-                el["sender"]["user_id"],
-                group_id,
-                el["media"],
-                geo_id
-            ))
-
-        query = """
-            INSERT INTO messages 
-            (m_id, text, date, changed_at, sender_id, group_id, media, geo_id) 
-            VALUES %s;
-        """
-        execute_values(cursor, query, values)
-        conn.commit()
+    values = []
+    for el in batch:
+        geo = el.get("geo")
+        values.append((
+            el["id"],
+            el["text"],
+            el["date"],
+            el["changed_at"],
+            el["sender"].get("user_id"),
+            group_id,
+            el["media"],
+            geo_ids.get((geo.get("latitude"), geo.get("longitude"))) if geo else None
+        ))
+
+    copy_rows(values, "messages", ("m_id", "text", "date", "changed_at", "sender_id", "group_id", "media", "geo_id"), conn)
+    conn.commit()
 
 
 def insert_pinned_messages(batch, group_id, conn):
@@ -94,30 +120,21 @@ def insert_pinned_messages(batch, group_id, conn):
         print("Failed to connect to the database.")
         return
 
-    geo_ids = {}
     values = []
+    for el in batch:
+        values.append((
+            el["id"],
+            el["text"],
+            el["from_id"],
+            el["date"],
+            el["changed_at"],
+        ))
 
     with conn.cursor() as cursor:
-        for el in batch:
-
-            geo_id = insert_geo(el, group_id, conn, geo_ids)
-
-            entry = (
-                el["id"],
-                el["text"],
-                el["from_id"],
-                el["date"],
-                el["changed_at"],
-            )
-
-            values.append(entry)
-
-            query = """
-                INSERT INTO pinned_messages 
-                (m_id, text, sender_id, date, changed_at) 
-                VALUES %s;
-            """
-            execute_values(cursor, query, values)
-            conn.commit()
-
-
+        query = """
+            INSERT INTO pinned_messages 
+            (m_id, text, sender_id, date, changed_at) 
+            VALUES %s;
+        """
+        execute_values(cursor, query, values)
+    conn.commit()
@@ -0,0 +1,59 @@
+import asyncio
+import sqlite3
+
+from database.sqlite_queries import (create_tables, upsert_group_info, upsert_messages, upsert_comments,
+                                     upsert_pinned_messages, upsert_admin_logs, upsert_participants,
+                                     insert_message_deltas)
+from database.writer import BatchWriter
+
+
+class SQLiteWriter(BatchWriter):
+    """Background writer to embedded SQLite archive, fed by a queue (see BatchWriter).\n
+    Database runs in WAL mode, so it can be queried while scraping. Every batch is one transaction,
+    rows are upserted by their telegram ids, so re-scraping the same messages doesn't duplicate them.
+    Several targets can share one database file.\n
+    **Usage:**
+        writer = SQLiteWriter(target_info, "archive.sqlite3")
+        await writer.write("messages", msg_data)
+        await writer.close()
+    """
+    HANDLERS = {
+        "messages": upsert_messages,
+        "comments": upsert_comments,
+        "pinned_messages": upsert_pinned_messages,
+        "admin_logs": upsert_admin_logs,
+        "participants": upsert_participants,
+        "message_deltas": insert_message_deltas,
+    }
+
+    def __init__(self, group_info: dict, path: str = "archive.sqlite3", batch_size: int = 500,
+                 flush_interval: float = 2.0, queue_size: int = 10000, on_flush=None):
+        self.path = path
+        super().__init__(group_info, batch_size=batch_size, flush_interval=flush_interval,
+                         queue_size=queue_size, on_flush=on_flush)
+
+    def _open(self):
+        try:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            create_tables(conn)
+            upsert_group_info(self.group_info, conn)
+        except sqlite3.Error as e:
+            raise ConnectionError(f"Failed to open SQLite database {self.path}: {e}") from e
+        return conn
+
+
+async def main():
+    writer = SQLiteWriter({"id": 0, "title": "test", "username": "test", "about": None}, "test.sqlite3", batch_size=2)
+    sender = {"user_id": 1, "first_name": "Test", "last_name": None, "username": None, "avatar": None, "is_bot": False}
+    for _ in range(2):  # the second pass is upserted, not duplicated
+        for i in range(5):
+            await writer.write("messages", {"id": i, "text": f"message {i}", "date": "2025-01-01T00:00:00", "changed_at": None,
+                                            "sender": sender, "media": None, "geo": {"latitude": 1.0, "longitude": 2.0}})
+    await writer.close()
+    print(f"Written {writer.written} messages")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,214 @@
+import json
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS groups (
+    group_id INTEGER PRIMARY KEY,
+    title TEXT,
+    username TEXT,
+    about TEXT
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    first_name TEXT,
+    last_name TEXT,
+    username TEXT,
+    avatar TEXT,
+    is_bot INTEGER
+);
+CREATE TABLE IF NOT EXISTS geo_locations (
+    id INTEGER PRIMARY KEY,
+    group_id INTEGER NOT NULL,
+    m_id INTEGER NOT NULL,
+    sender_id INTEGER,
+    latitude REAL,
+    longitude REAL,
+    UNIQUE (group_id, m_id)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    group_id INTEGER NOT NULL,
+    m_id INTEGER NOT NULL,
+    text TEXT,
+    date TEXT,
+    changed_at TEXT,
+    sender_id INTEGER,
+    media TEXT,
+    geo_id INTEGER,
+    PRIMARY KEY (group_id, m_id)
+);
+CREATE INDEX IF NOT EXISTS messages_sender_date ON messages (sender_id, date);
+CREATE INDEX IF NOT EXISTS messages_date ON messages (date);
+CREATE TABLE IF NOT EXISTS comments (
+    group_id INTEGER NOT NULL,
+    c_id INTEGER NOT NULL,
+    post_id INTEGER NOT NULL,
+    text TEXT,
+    date TEXT,
+    changed_at TEXT,
+    user_id INTEGER,
+    PRIMARY KEY (group_id, c_id)
+);
+CREATE INDEX IF NOT EXISTS comments_post ON comments (group_id, post_id);
+CREATE TABLE IF NOT EXISTS pinned_messages (
+    group_id INTEGER NOT NULL,
+    m_id INTEGER NOT NULL,
+    text TEXT,
+    sender_id INTEGER,
+    date TEXT,
+    changed_at TEXT,
+    PRIMARY KEY (group_id, m_id)
+);
+CREATE TABLE IF NOT EXISTS admin_logs (
+    group_id INTEGER NOT NULL,
+    event_id INTEGER NOT NULL,
+    action TEXT,
+    details TEXT,
+    user_id INTEGER,
+    timestamp TEXT,
+    error TEXT,
+    PRIMARY KEY (group_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS admin_logs_timestamp ON admin_logs (timestamp);
+CREATE INDEX IF NOT EXISTS admin_logs_action ON admin_logs (group_id, action);
+CREATE TABLE IF NOT EXISTS message_deltas (
+    group_id INTEGER NOT NULL,
+    m_id INTEGER NOT NULL,
+    detected_at TEXT NOT NULL,
+    changes TEXT,
+    text TEXT,
+    changed_at TEXT,
+    replies INTEGER,
+    reactions TEXT,
+    PRIMARY KEY (group_id, m_id, detected_at)
+);
+"""
+
+
+def create_tables(conn):
+    # Archives created before admin log details were added get the column first (index depends on table only)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(admin_logs);")]
+    if columns and "details" not in columns:
+        conn.execute("ALTER TABLE admin_logs ADD COLUMN details TEXT;")
+    conn.executescript(SCHEMA)
+
+
+def upsert_users(users, conn):
+    """Upsert users deduplicated by user_id, missing fields (e.g. of senders which failed to resolve)
+    don't overwrite saved ones"""
+    unique = {}
+    for user in users:
+        if user and user.get("user_id"):
+            unique[user["user_id"]] = user
+    conn.executemany(
+        """INSERT INTO users (user_id, first_name, last_name, username, avatar, is_bot)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            first_name = COALESCE(excluded.first_name, users.first_name),
+            last_name = COALESCE(excluded.last_name, users.last_name),
+            username = COALESCE(excluded.username, users.username),
+            avatar = COALESCE(excluded.avatar, users.avatar),
+            is_bot = COALESCE(excluded.is_bot, users.is_bot);
+        """,
+        [(u["user_id"], u.get("first_name"), u.get("last_name"), u.get("username"), u.get("avatar"), u.get("is_bot"))
+         for u in unique.values()]
+    )
+
+
+def upsert_group_info(group_info, conn):
+    with conn:
+        conn.execute(
+            """INSERT INTO groups (group_id, title, username, about) VALUES (?, ?, ?, ?)
+            ON CONFLICT (group_id) DO UPDATE SET
+                title = excluded.title,
+                username = excluded.username,
+                about = COALESCE(excluded.about, groups.about);
+            """,
+            (group_info["id"], group_info["title"], group_info["username"], group_info.get("about"))
+        )
+
+
+def upsert_messages(batch, group_id, conn):
+    """Upsert batch of messages with their senders and geo locations in one transaction"""
+    with conn:
+        upsert_users([el["sender"] for el in batch], conn)
+        conn.executemany(
+            """INSERT INTO geo_locations (group_id, m_id, sender_id, latitude, longitude) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (group_id, m_id) DO UPDATE SET latitude = excluded.latitude, longitude = excluded.longitude;
+            """,
+            [(group_id, el["id"], el["sender"].get("user_id"), el["geo"]["latitude"], el["geo"]["longitude"])
+             for el in batch if el.get("geo")]
+        )
+        conn.executemany(
+            """INSERT INTO messages (group_id, m_id, text, date, changed_at, sender_id, media, geo_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, (SELECT id FROM geo_locations WHERE group_id = ? AND m_id = ?))
+            ON CONFLICT (group_id, m_id) DO UPDATE SET
+                text = excluded.text,
+                changed_at = excluded.changed_at,
+                media = COALESCE(excluded.media, messages.media),
+                geo_id = excluded.geo_id;
+            """,
+            [(group_id, el["id"], el["text"], el["date"], el["changed_at"], el["sender"].get("user_id"), el["media"],
+              group_id, el["id"]) for el in batch]
+        )
+
+
+def upsert_comments(batch, group_id, conn):
+    with conn:
+        conn.executemany(
+            """INSERT INTO comments (group_id, c_id, post_id, text, date, changed_at, user_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (group_id, c_id) DO UPDATE SET text = excluded.text, changed_at = excluded.changed_at;
+            """,
+            [(group_id, el["id"], el["post_id"], el["text"], el["date"], el["changed_at"], el["user_id"]) for el in batch]
+        )
+
+
+def upsert_pinned_messages(batch, group_id, conn):
+    with conn:
+        conn.executemany(
+            """INSERT INTO pinned_messages (group_id, m_id, text, sender_id, date, changed_at) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (group_id, m_id) DO UPDATE SET text = excluded.text, changed_at = excluded.changed_at;
+            """,
+            [(group_id, el["id"], el["text"], el["from_id"], el["date"], el["changed_at"]) for el in batch]
+        )
+
+
+def upsert_admin_logs(batch, group_id, conn):
+    with conn:
+        upsert_users([el["performed_by"] for el in batch if not el.get("error")], conn)
+        conn.executemany(
+            """INSERT INTO admin_logs (group_id, event_id, action, details, user_id, timestamp, error)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (group_id, event_id) DO UPDATE SET
+                action = excluded.action,
+                details = excluded.details,
+                error = excluded.error;
+            """,
+            [(group_id, el["id"], el["action"],
+              json.dumps(el["details"], ensure_ascii=False) if el.get("details") is not None else None,
+              el["performed_by"]["user_id"], el["timestamp"], el.get("error"))
+             for el in batch]
+        )
+
+
+def upsert_participants(batch, group_id, conn):
+    with conn:
+        upsert_users(batch, conn)
+
+
+def insert_message_deltas(batch, group_id, conn):
+    """Save deltas found by re-verification, edited messages get their new text in messages table"""
+    with conn:
+        conn.executemany(
+            """INSERT INTO message_deltas (group_id, m_id, detected_at, changes, text, changed_at, replies, reactions)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (group_id, m_id, detected_at) DO NOTHING;
+            """,
+            [(group_id, el["id"], el["detected_at"], ",".join(el["changes"]), el.get("text"), el.get("changed_at"),
+              el.get("replies"), json.dumps(el.get("reactions"), ensure_ascii=False) if el.get("reactions") else None)
+             for el in batch]
+        )
+        conn.executemany(
+            "UPDATE messages SET text = ?, changed_at = ? WHERE group_id = ? AND m_id = ?;",
+            [(el["text"], el["changed_at"], group_id, el["id"]) for el in batch if "edited" in el["changes"]]
+        )
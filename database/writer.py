@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+
+class BatchWriter:
+    """Base of background database writers (sinks), fed by a queue.\n
+    Records are written with write(kind, record), the same interface as bot.output.OutputStream.
+    Writer thread collects them into batches and flushes each batch when it reaches batch_size records
+    or flush_interval seconds passed, using one reused connection (opened in writer thread).
+    write(), flush() and close() are coroutines which never block event loop: when the queue is full
+    (or writer thread is busy flushing), they wait for it in executor thread.
+    Subclasses define HANDLERS {kind: function(batch, group_id, conn)} and _open().
+    """
+    HANDLERS = {}
+
+    def __init__(self, group_info: dict, batch_size: int = 500, flush_interval: float = 2.0,
+                 queue_size: int = 10000, on_flush=None):
+        self.group_info = group_info
+        self.group_id = group_info["id"]
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.on_flush = on_flush  # called with (kind, number of records, seconds) after each batch
+
+        self._conn = None
+        self._batches = {kind: [] for kind in self.HANDLERS}
+        self._flushed_at = time.monotonic()
+        self._put_lock = asyncio.Lock()  # keeps records in order while one of them waits for free space
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    async def write(self, kind: str, record: dict):
+        """Queue record for writing, kinds without DB table are ignored"""
+        if kind in self.HANDLERS:
+            await self._put((kind, record))
+
+    async def flush(self):
+        """Ask writer thread to flush everything queued so far and wait for it"""
+        done = threading.Event()
+        await self._put(("flush", done))
+        await asyncio.to_thread(done.wait)
+
+    async def close(self):
+        """Flush remaining records and stop writer thread"""
+        if self._thread.is_alive():
+            await self._put(("close", None))
+            await asyncio.to_thread(self._thread.join)
+
+    async def _put(self, item: tuple):
+        async with self._put_lock:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                await asyncio.get_running_loop().run_in_executor(None, self.queue.put, item)
+
+    def _open(self):
+        """Open new connection, raises ConnectionError if it's not possible"""
+        raise NotImplementedError
+
+    def _connection(self):
+        if self._conn is None or getattr(self._conn, "closed", False):
+            self._conn = self._open()
+        return self._conn
+
+    def _reset_connection(self):
+        """Drop broken connection, next batch will open a new one"""
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def _run(self):
+        while True:
+            try:
+                kind, record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                kind, record = None, None
+
+            if kind == "close":
+                self._flush_all()
+                if self._conn is not None:
+                    self._conn.close()
+                return
+            if kind == "flush":
+                self._flush_all()
+                record.set()
+                continue
+            if kind is not None:
+                batch = self._batches[kind]
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    self._flush(kind)
+
+            if time.monotonic() - self._flushed_at >= self.flush_interval:
+                self._flush_all()
+
+    def _flush_all(self):
+        for kind in self._batches:
+            self._flush(kind)
+        self._flushed_at = time.monotonic()
+
+    def _flush(self, kind: str):
+        batch = self._batches[kind]
+        if not batch:
+            return
+        self._batches[kind] = []
+        name = type(self).__name__
+        for _ in range(2):
+            try:
+                start = time.time()
+                self.HANDLERS[kind](batch, self.group_id, self._connection())
+                self.written += len(batch)
+                logging.debug(f"[{name}] Saved {len(batch)} {kind} in {time.time() - start:.2f} seconds")
+                if self.on_flush:
+                    self.on_flush(kind, len(batch), time.time() - start)
+                return
+            except Exception as e:
+                logging.warning(f"[{name}] Failed to save {len(batch)} {kind}: {e}")
+                self._reset_connection()
+        logging.error(f"[{name}] Dropped batch of {len(batch)} {kind}, see JSONL output for data")
@@ -1,14 +1,14 @@
 import asyncio
 import os
+import sys
 import threading
-from bot import Scraper, Config, dump_json
-from bot.utils import get_last_message_id
-from bot import Config
-from bot.settings import logging
+from bot import cli
+from bot.settings import Config, logging
 
 
 target_channel = ""
 start_from_last_msg = False
+only_new_messages = False
 specify_limit_offset = False
 user_limit, user_offset = None, None
 
@@ -19,9 +19,11 @@ def ask_for_limit_n_offset():
 
 
 def menu():
-    global target_channel, start_from_last_msg, specify_limit_offset
+    global target_channel, start_from_last_msg, only_new_messages, specify_limit_offset
     target_channel = input("Enter channel username: ")
     start_from_last_msg = True if input("Do you want to start from last scraped message? y/n: ").lower() == "y" else False
+    if start_from_last_msg:
+        only_new_messages = True if input("Fetch only messages newer than last run (n) or continue with older ones (o)? n/o: ").lower() == "n" else False
     specify_limit_offset = True if input("Do you want to specify limit and offset manually? y/n: ").lower() == "y" else False
     if specify_limit_offset:
         ask_for_limit_n_offset()
@@ -40,10 +42,16 @@ def input_listener():
 
 async def main():
     global user_limit, user_offset
+    from bot import Scraper
+    from bot.scheduler import scrape_target
+    from bot.utils import get_last_message_id
+    from bot.metrics import metrics
+
     folders = Config.get_folders(target_channel)
     bot = Scraper(target_channel)
     await bot.initialize()
     offset = 0
+    min_id = 0
     limit = 100
 
     input_thread = threading.Thread(target=input_listener)
@@ -52,9 +60,13 @@ async def main():
     if Config.stop_event.is_set():
         return
 
-    if start_from_last_msg:
-        offset = get_last_message_id(os.path.join(folders["jsons_folder"], "messages.json"))
-        logging.info(f"Set offset of fetch_message to last message_id: {offset}")
+    if start_from_last_msg and only_new_messages:
+        min_id = get_last_message_id(os.path.join(folders["jsons_folder"], "messages.json"))
+        limit = None  # Incremental run has to reach min_id, otherwise it would leave a gap
+        logging.info(f"Set min_id of fetch_message to last message_id: {min_id}")
+    elif start_from_last_msg:
+        offset = bot.checkpoint.min_id or 0
+        logging.info(f"Set offset of fetch_message to lowest scraped message_id: {offset}")
 
     if specify_limit_offset:
         if user_limit is not None:
@@ -64,20 +76,19 @@ async def main():
             offset = user_offset
             logging.debug(f"Found user specified offset, overriding last message_id offset")
 
-    logging.debug(f"Passed limit: {limit}, offset: {offset}")
-    data_dict = {
-        "messages": await bot.fetch_messages(limit=limit, offset=offset),
-        "participants": await bot.get_members(),
-        "pinned_messages": await bot.get_pinned_messages(),
-        "target_info": await bot.fetch_target_info(),
-        "admin_logs": await bot.get_admin_log(),
-    }
-
-    for name, data in data_dict.items():
-        dump_json(data, f"{folders['jsons_folder']}/{name}")
+    metrics.start_exporter()
+    data_dict = await scrape_target(bot, limit=limit, offset=offset, min_id=min_id)
+    await metrics.stop_exporter()
+    for name, error in data_dict.get("errors", {}).items():
+        print(f"Stage {name} failed: {error}")
 
     input_thread.join()
 
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Arguments given, run without prompts (see bot/cli.py)
+        sys.exit(cli.main())
+    Config.setup_logging()
     menu()
     asyncio.run(main())